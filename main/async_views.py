@@ -0,0 +1,116 @@
+import asyncio
+import logging
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.mixins import AccessMixin
+from django.http import Http404, HttpResponseNotAllowed, JsonResponse
+from main import ingestion, views
+from main.models import UserActivity, Voting
+from main.pagination import KeysetPage
+from main.ratelimit import rate_limit
+from main.results import aget_voted_variant_ids, get_cached_results
+
+
+async def _aget_or_404(queryset, **kwargs):
+    try:
+        return await queryset.aget(**kwargs)
+    except queryset.model.DoesNotExist:
+        raise Http404(f'No {queryset.model._meta.object_name} matches the given query.')
+
+
+class AsyncLoginRequiredMixin(AccessMixin):
+    async def dispatch(self, request, *args, **kwargs):
+        if not await sync_to_async(lambda: request.user.is_authenticated)():
+            return self.handle_no_permission()
+        return await super().dispatch(request, *args, **kwargs)
+
+
+class ListVotingsPage(AsyncLoginRequiredMixin, views.ListVotingsPage):
+    async def get(self, request, *args, **kwargs):
+        if self.get_search_query():
+            self.page = await sync_to_async(self.get_search_page)(self.get_queryset(), self.paginate_by)
+        else:
+            self.page = await KeysetPage.acreate(
+                self.get_queryset(), self.get_keyset_fields(), request.GET.get('cursor'), self.paginate_by
+            )
+        self.object_list = self.page.object_list
+        self.card_context = await sync_to_async(super().get_card_context)(self.object_list)
+        return self.render_to_response(self.get_context_data())
+
+    def get_card_context(self, votings):
+        return self.card_context
+
+    def paginate_queryset(self, queryset, page_size):
+        return None, self.page, self.page.object_list, self.page.has_next
+
+
+class ListVotingsJson(ListVotingsPage, views.ListVotingsJson):
+    pass
+
+
+class VotingPage(AsyncLoginRequiredMixin, views.VotingPage):
+    async def get(self, request, *args, **kwargs):
+        voting = await _aget_or_404(Voting.objects.select_related('author'), id=self.kwargs['id'])
+        voted_variant_ids, (results_version, questions), liked_ids = await asyncio.gather(
+            aget_voted_variant_ids(voting, request.user),
+            sync_to_async(get_cached_results)(voting),
+            sync_to_async(Voting.get_liked_ids)(request.user, [voting.id]),
+        )
+        if not voted_variant_ids and ingestion.is_enabled():
+            voted_variant_ids = await sync_to_async(ingestion.get_pending_variant_ids)(voting, request.user)
+        context = super(views.VotingPage, self).get_context_data(**kwargs)
+        context.update({
+            'title': 'Voting',
+            'BASE_URL': views.BASE_URL,
+            'voting': voting,
+            'results_version': results_version,
+            'questions': questions,
+            'liked': voting.id in liked_ids,
+            'results_stream': settings.RESULTS_STREAM_ENABLED,
+            'voted': len(voted_variant_ids) > 0,
+            'voted_variant_ids': voted_variant_ids,
+        })
+        return self.render_to_response(context)
+
+    async def post(self, request, *args, **kwargs):
+        return await sync_to_async(super().post)(request, *args, **kwargs)
+
+
+class ProfilePage(AsyncLoginRequiredMixin, views.ProfilePage):
+    async def get(self, request, *args, **kwargs):
+        user = await _aget_or_404(get_user_model().objects, id=self.kwargs['id'])
+        context = super(views.ProfilePage, self).get_context_data(**kwargs)
+        context.update({
+            'title': 'Profile',
+            'user': user,
+            'is_same_user': user == request.user,
+            'activity': await sync_to_async(UserActivity.get_for)(user),
+        })
+        return self.render_to_response(context)
+
+
+class ProfileSectionPage(AsyncLoginRequiredMixin, views.ProfileSectionPage):
+    async def get(self, request, *args, **kwargs):
+        user = await _aget_or_404(get_user_model().objects, id=self.kwargs['id'])
+        queryset, fields = self.get_section(user)
+        page = await KeysetPage.acreate(queryset, fields, request.GET.get('cursor'), self.paginate_by)
+        votings = self.get_votings(page)
+        cards = await sync_to_async(views.prepare_cards)(request.user, votings)
+        context = super(views.ProfileSectionPage, self).get_context_data(**kwargs)
+        return self.render_to_response(self.get_page_context(context, page, votings, cards))
+
+
+@rate_limit('like')
+async def like_voting(request, id: int):
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    user = await sync_to_async(lambda: request.user if request.user.is_authenticated else None)()
+    if user is None:
+        return JsonResponse({'message': 'Login required'}, status=401)
+    voting = await Voting.objects.filter(id=id).afirst()
+    if voting is None:
+        return JsonResponse({'message': 'Invalid id'}, status=404)
+    liked = await sync_to_async(voting.like)(user)
+    logging.info('User %s %s voting %s', user, 'liked' if liked else 'unliked', voting)
+    return JsonResponse({'liked': liked, 'likes_count': voting.likes_count}, status=200)
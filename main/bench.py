@@ -0,0 +1,91 @@
+import asyncio
+import os
+import random
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, List
+from django.conf import settings
+from django.db import connection
+from django.test.utils import setup_databases, teardown_databases
+
+
+@contextmanager
+def bench_database():
+    old_debug, settings.DEBUG = settings.DEBUG, False
+    directory = None
+    if connection.vendor == 'sqlite':
+        # A file, not the shared in-memory database, so worker threads do not lock each other out.
+        directory = tempfile.mkdtemp()
+        connection.settings_dict['TEST']['NAME'] = os.path.join(directory, 'bench.sqlite3')
+    try:
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            yield
+        finally:
+            teardown_databases(old_config, verbosity=0)
+    finally:
+        settings.DEBUG = old_debug
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies: List[float], elapsed: float, errors: int = 0) -> Dict:
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+async def run_concurrently(call: Callable[[int], Awaitable[bool]], requests: int, concurrency: int) -> Dict:
+    latencies = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            start = time.perf_counter()
+            ok = await call(i)
+            latencies.append(time.perf_counter() - start)
+            errors += not ok
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - start, errors)
+
+
+async def run_mix(calls: Dict[str, Callable[[int], Awaitable[bool]]], weights: Dict[str, int], requests: int,
+                  concurrency: int, seed: int = 0) -> Dict:
+    rng = random.Random(seed)
+    names = rng.choices(list(weights), weights=list(weights.values()), k=requests)
+    latencies = {name: [] for name in calls}
+    errors = dict.fromkeys(calls, 0)
+    counter = iter(range(requests))
+
+    async def worker():
+        for i in counter:
+            start = time.perf_counter()
+            ok = await calls[names[i]](i)
+            latencies[names[i]].append(time.perf_counter() - start)
+            errors[names[i]] += not ok
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    report = {name: summarize(latencies[name], elapsed, errors[name]) for name in calls}
+    report['total'] = summarize(sum(latencies.values(), []), elapsed, sum(errors.values()))
+    return report
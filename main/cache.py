@@ -0,0 +1,96 @@
+import time
+from typing import Any, Callable, Dict, Iterable, Set, Tuple
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.utils import make_template_fragment_key
+
+
+def get_results_cache():
+    return caches['results']
+
+
+def get_fragment_cache():
+    return caches['template_fragments']
+
+
+def _version_key(voting_id: int) -> str:
+    return f'results:version:{voting_id}'
+
+
+def _entry_key(voting_id: int) -> str:
+    return f'results:entry:{voting_id}'
+
+
+def _lock_key(voting_id: int) -> str:
+    return f'results:lock:{voting_id}'
+
+
+def _fragment_version_key(voting_id: int) -> str:
+    return f'fragments:version:{voting_id}'
+
+
+def _init_version(cache, key: str) -> int:
+    # A missing version (never set or evicted) restarts from the clock, so entries
+    # computed before the eviction can never look current again.
+    cache.add(key, time.time_ns(), None)
+    return cache.get(key)
+
+
+def _bump_version(cache, key: str):
+    try:
+        cache.incr(key)
+    except ValueError:
+        _init_version(cache, key)
+
+
+def bump_results_version(voting_id: int):
+    _bump_version(get_results_cache(), _version_key(voting_id))
+
+
+def get_results_version(voting_id: int) -> int:
+    cache = get_results_cache()
+    return cache.get(_version_key(voting_id)) or _init_version(cache, _version_key(voting_id))
+
+
+def bump_fragment_version(voting_id: int):
+    _bump_version(get_fragment_cache(), _fragment_version_key(voting_id))
+
+
+def get_fragment_versions(voting_ids: Iterable[int]) -> Dict[int, int]:
+    # Card fragments are cached under the voting id and this version, see votings/voting_card.html.
+    cache = get_fragment_cache()
+    keys = {_fragment_version_key(voting_id): voting_id for voting_id in voting_ids}
+    versions = cache.get_many(keys.keys())
+    return {voting_id: versions.get(key) or _init_version(cache, key) for key, voting_id in keys.items()}
+
+
+def get_missing_fragment_ids(name: str, versions: Dict[int, int]) -> Set[int]:
+    keys = {
+        make_template_fragment_key(name, [voting_id, version]): voting_id for voting_id, version in versions.items()
+    }
+    cached = get_fragment_cache().get_many(keys.keys())
+    return {voting_id for key, voting_id in keys.items() if key not in cached}
+
+
+def get_or_compute_results(voting_id: int, compute: Callable[[], Any]) -> Tuple[int, Any]:
+    # Returns the version of the results served, which is older than the current one while
+    # another worker recomputes them. Fragments rendered from them must be keyed on it.
+    cache = get_results_cache()
+    values = cache.get_many([_version_key(voting_id), _entry_key(voting_id)])
+    version = values.get(_version_key(voting_id))
+    if version is None:
+        version = _init_version(cache, _version_key(voting_id))
+    entry = values.get(_entry_key(voting_id))
+    if entry is not None and entry[0] == version:
+        return entry
+    # Only the holder of the lock recomputes a stale entry, the others keep serving it.
+    locked = entry is not None and cache.add(_lock_key(voting_id), 1, settings.RESULTS_CACHE_LOCK_TIMEOUT)
+    if entry is not None and not locked:
+        return entry
+    try:
+        results = compute()
+        cache.set(_entry_key(voting_id), (version, results))
+    finally:
+        if locked:
+            cache.delete(_lock_key(voting_id))
+    return version, results
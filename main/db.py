@@ -0,0 +1,50 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+
+# Set by ReplicaMiddleware while a read-only view marked with replica_reads runs.
+replica_reads: ContextVar[bool] = ContextVar('replica_reads', default=False)
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    # Straight on the sqlite3 connection, so the pragmas stay out of the query metrics.
+    if connection.vendor != 'sqlite':
+        return
+    for pragma, value in settings.SQLITE_PRAGMAS.items():
+        connection.connection.execute(f'PRAGMA {pragma} = {value}')
+
+
+def reads_from_replica(view):
+    view.replica_reads = True
+    return view
+
+
+def is_replica_read() -> bool:
+    return bool(settings.DATABASE_REPLICA_ALIASES) and replica_reads.get()
+
+
+@contextmanager
+def primary_reads():
+    token = replica_reads.set(False)
+    try:
+        yield
+    finally:
+        replica_reads.reset(token)
+
+
+class ReplicaRouter:
+    # Only the voting data goes to replicas, sessions and users are always read fresh.
+    def db_for_read(self, model, **hints):
+        if is_replica_read() and model._meta.app_label == 'main':
+            return random.choice(settings.DATABASE_REPLICA_ALIASES)
+        return None
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.DATABASE_REPLICA_ALIASES
@@ -48,12 +48,10 @@ class CreateVariantForm(forms.ModelForm):
 class CreateComplaint(forms.ModelForm):
     class Meta:
         model = Complaint
-        fields = ['text', 'voting', 'user']
+        fields = ['text']
         labels = {
             'text': 'Complaint Text',
         }
         widgets = {
             'text': forms.Textarea(attrs={'class': 'form-control', 'autocomplete': 'off'}),
-            'voting': forms.HiddenInput(),
-            'user': forms.HiddenInput(),
         }
@@ -0,0 +1,234 @@
+import atexit
+import json
+import logging
+import queue
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Set
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from main.models import Participation, UserActivity, Variant, VoteFact, Voting
+from main.signals import votes_cast
+
+
+class VoteQueueFull(Exception):
+    pass
+
+
+class LocalVoteQueue:
+    def __init__(self, max_size: int):
+        self.queue = queue.Queue(maxsize=max_size)
+
+    def put(self, ballot: Dict, timeout: float) -> bool:
+        try:
+            self.queue.put(ballot, timeout=timeout)
+        except queue.Full:
+            return False
+        return True
+
+    def get_batch(self, max_items: int, timeout: float) -> List[Dict]:
+        try:
+            batch = [self.queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(batch) < max_items:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def size(self) -> int:
+        return self.queue.qsize()
+
+
+class RedisVoteQueue:
+    # Checks the length and pushes in one step, so concurrent puts cannot overfill the queue.
+    PUT_SCRIPT = '''
+        if redis.call('LLEN', KEYS[1]) >= tonumber(ARGV[1]) then
+            return 0
+        end
+        return redis.call('RPUSH', KEYS[1], ARGV[2])
+    '''
+
+    def __init__(self, max_size: int, url: str, key: str = 'votings:ballots'):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.max_size = max_size
+        self.key = key
+        self.put_script = self.client.register_script(self.PUT_SCRIPT)
+
+    def put(self, ballot: Dict, timeout: float) -> bool:
+        return bool(self.put_script(keys=[self.key], args=[self.max_size, json.dumps(ballot)]))
+
+    def get_batch(self, max_items: int, timeout: float) -> List[Dict]:
+        first = self.client.blpop([self.key], timeout=timeout)
+        if first is None:
+            return []
+        rest = self.client.lpop(self.key, max_items - 1) if max_items > 1 else None
+        return [json.loads(item) for item in [first[1], *(rest or [])]]
+
+    def size(self) -> int:
+        return self.client.llen(self.key)
+
+
+def get_existing_pairs(pairs: Iterable) -> Set:
+    pairs = list(pairs)
+    return set(
+        Participation.objects.filter(
+            user_id__in={user_id for user_id, _ in pairs},
+            voting_id__in={voting_id for _, voting_id in pairs},
+        ).values_list('user_id', 'voting_id')
+    )
+
+
+def _write_ballots(unique: Dict) -> int:
+    with transaction.atomic():
+        existing = get_existing_pairs(unique)
+        new = {pair: variant_ids for pair, variant_ids in unique.items() if pair not in existing}
+        Participation.objects.bulk_create(
+            [Participation(user_id=user_id, voting_id=voting_id) for user_id, voting_id in new]
+        )
+        variants = Variant.objects.only('id', 'question_id').in_bulk(
+            {variant_id for variant_ids in new.values() for variant_id in variant_ids}
+        )
+        vote_facts = [
+            VoteFact(user_id=user_id, variant=variants[variant_id])
+            for (user_id, _), variant_ids in new.items()
+            for variant_id in variant_ids
+            if variant_id in variants
+        ]
+        VoteFact.add_votes(vote_facts)
+        Voting.add_to_rankings('vote', Counter(voting_id for _, voting_id in new))
+        UserActivity.add('voted_count', Counter(user_id for user_id, _ in new))
+        votes = defaultdict(Counter)
+        for (_, voting_id), variant_ids in new.items():
+            votes[voting_id].update(variant_id for variant_id in variant_ids if variant_id in variants)
+        votes_cast.send(sender=Voting, votes=votes)
+    return len(new)
+
+
+def write_ballots(ballots: List[Dict]) -> int:
+    # A batch that fails, e.g. on a participation written meanwhile by another process, is
+    # retried one ballot at a time so that only the failing ballots are rejected.
+    unique = {}
+    for ballot in ballots:
+        unique.setdefault((ballot['user_id'], ballot['voting_id']), ballot['variant_ids'])
+    try:
+        written = _write_ballots(unique)
+    except Exception:
+        logging.warning('Vote batch of %s ballots failed, writing them one by one.', len(unique), exc_info=True)
+        written = 0
+        for pair, variant_ids in unique.items():
+            try:
+                written += _write_ballots({pair: variant_ids})
+            except Exception:
+                logging.exception('Rejected ballot of user %s for voting %s.', *pair)
+    finally:
+        for user_id, voting_id in unique:
+            get_pending_cache().delete(pending_key(user_id, voting_id))
+    return written
+
+
+class VoteWriter(threading.Thread):
+    def __init__(self, vote_queue, batch_size: int, flush_interval: float):
+        super().__init__(name='vote-writer', daemon=True)
+        self.vote_queue = vote_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.stopping = threading.Event()
+
+    def run(self):
+        while not self.stopping.is_set():
+            self.flush()
+        while self.flush():
+            pass
+
+    def flush(self) -> int:
+        batch = self.vote_queue.get_batch(self.batch_size, self.flush_interval)
+        if not batch:
+            return 0
+        try:
+            written = write_ballots(batch)
+            logging.info('Vote writer saved %s of %s ballots.', written, len(batch))
+        except Exception:
+            logging.exception('Vote writer failed to save %s ballots.', len(batch))
+        return len(batch)
+
+    def stop(self, timeout: Optional[float] = None):
+        self.stopping.set()
+        self.join(timeout)
+
+
+_queue = None
+_writer = None
+_lock = threading.Lock()
+
+
+def is_enabled() -> bool:
+    return settings.VOTE_INGESTION['ENABLED']
+
+
+def get_queue():
+    global _queue
+    with _lock:
+        if _queue is None:
+            config = settings.VOTE_INGESTION
+            if config['BACKEND'] == 'redis':
+                _queue = RedisVoteQueue(config['MAX_QUEUE_SIZE'], config['REDIS_URL'])
+            else:
+                _queue = LocalVoteQueue(config['MAX_QUEUE_SIZE'])
+        return _queue
+
+
+def start_writer() -> VoteWriter:
+    global _writer
+    vote_queue = get_queue()
+    with _lock:
+        if _writer is None:
+            config = settings.VOTE_INGESTION
+            _writer = VoteWriter(vote_queue, config['BATCH_SIZE'], config['FLUSH_INTERVAL'])
+            _writer.start()
+            atexit.register(stop_writer)
+        return _writer
+
+
+def stop_writer(timeout: Optional[float] = None):
+    global _writer
+    with _lock:
+        writer, _writer = _writer, None
+    if writer is not None:
+        writer.stop(timeout)
+
+
+def get_pending_cache():
+    return caches['pending_votes']
+
+
+def pending_key(user_id: int, voting_id: int) -> str:
+    return f'pending_vote:{user_id}:{voting_id}'
+
+
+def get_pending_variant_ids(voting: Voting, user) -> Set[int]:
+    return set(get_pending_cache().get(pending_key(user.id, voting.id), []))
+
+
+def submit_vote(voting: Voting, user, variant_ids: Iterable) -> bool:
+    if not is_enabled():
+        return voting.vote(user, variant_ids)
+    variants = voting.get_chosen_variants(variant_ids)
+    if voting.is_user_voted(user):
+        return False
+    ballot = {'user_id': user.id, 'voting_id': voting.id, 'variant_ids': [variant.id for variant in variants]}
+    config = settings.VOTE_INGESTION
+    key = pending_key(user.id, voting.id)
+    if not get_pending_cache().add(key, ballot['variant_ids'], config['PENDING_TIMEOUT']):
+        return False
+    if config['START_WRITER']:
+        start_writer()
+    if not get_queue().put(ballot, config['PUT_TIMEOUT']):
+        get_pending_cache().delete(key)
+        raise VoteQueueFull()
+    return True
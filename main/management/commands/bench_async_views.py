@@ -0,0 +1,79 @@
+import asyncio
+import json
+import logging
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.test import AsyncRequestFactory
+from main import async_views, bench, views
+from main.models import Voting, Question, Variant
+
+
+class Command(BaseCommand):
+    help = 'Compare requests per second and latency of the sync and async read views under the same concurrency.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--votings', type=int, default=200)
+        parser.add_argument('--rate-limit', action='store_true', help='Keep the endpoint rate limits on.')
+
+    def handle(self, *args, **options):
+        logging.disable(logging.INFO)
+        # A single user would hit the 'like' limits after a few requests and the benchmark would time 429s.
+        old_rate_limit, settings.RATE_LIMIT_ENABLED = settings.RATE_LIMIT_ENABLED, options['rate_limit']
+        try:
+            with bench.bench_database():
+                user, voting = self.seed(options['votings'])
+                report = asyncio.run(self.run(user, voting, options['requests'], options['concurrency']))
+        finally:
+            settings.RATE_LIMIT_ENABLED = old_rate_limit
+            logging.disable(logging.NOTSET)
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def seed(self, votings: int):
+        user = get_user_model().objects.create_user('bench', password='bench')
+        Voting.objects.bulk_create([Voting(title=f'Voting {i}', author=user, published=True) for i in range(votings)])
+        voting = Voting.objects.first()
+        for i in range(5):
+            question = Question.objects.create(title=f'Question {i}', description='', voting=voting, type=2)
+            Variant.objects.bulk_create([Variant(text=f'Variant {j}', question=question) for j in range(5)])
+        for other in Voting.objects.all()[:votings // 2]:
+            other.like(user)
+        voting.vote(user, [question.variant_set.first().id])
+        return user, voting
+
+    async def run(self, user, voting, requests: int, concurrency: int):
+        factory = AsyncRequestFactory()
+        endpoints = {
+            'list_votings': ('ListVotingsPage', lambda: factory.get('/votings/list/'), {}),
+            'voting': ('VotingPage', lambda: factory.get(f'/votings/{voting.id}/'), {'id': voting.id}),
+            'profile': ('ProfilePage', lambda: factory.get(f'/profile/{user.id}/'), {'id': user.id}),
+            'like': ('like_voting', lambda: factory.post(f'/votings/{voting.id}/like/'), {'id': voting.id}),
+        }
+        report = {}
+        for name, (view_name, make_request, kwargs) in endpoints.items():
+            report[name] = {}
+            for mode, module in (('sync', views), ('async', async_views)):
+                view = getattr(module, view_name)
+                view = view.as_view() if isinstance(view, type) else view
+                call = self.make_call(view, make_request, user, kwargs, mode == 'async')
+                report[name][mode] = await bench.run_concurrently(call, requests, concurrency)
+        return report
+
+    @staticmethod
+    def make_call(view, make_request, user, kwargs, is_async: bool):
+        # Sync views are run the way the ASGI handler runs them: on the shared sync thread.
+        run_view = view if is_async else sync_to_async(view)
+
+        async def call(i: int) -> bool:
+            request = make_request()
+            request.user = user
+            request._dont_enforce_csrf_checks = True
+            response = await run_view(request, **kwargs)
+            if hasattr(response, 'render'):
+                await sync_to_async(response.render)()
+            return response.status_code < 400
+
+        return call
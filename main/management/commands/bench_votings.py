@@ -0,0 +1,238 @@
+import asyncio
+import io
+import json
+import logging
+import random
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+from urllib.parse import urlencode
+from wsgiref.util import setup_testing_defaults
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import Client
+from django.utils.crypto import get_random_string
+from main import bench, ranking
+from main.models import Like, Participation, Question, UserActivity, Variant, VoteFact, Voting
+
+WEIGHTS = {'list_votings': 30, 'voting': 25, 'results': 20, 'vote': 10, 'like': 15}
+
+
+class Command(BaseCommand):
+    help = 'Seed a benchmark database and drive mixed voting traffic through the WSGI and ASGI applications.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--votings', type=int, default=50)
+        parser.add_argument('--questions', type=int, default=3)
+        parser.add_argument('--variants', type=int, default=4)
+        parser.add_argument('--votes', type=int, default=2000, help='Ballots cast before the traffic starts.')
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--server', choices=['wsgi', 'asgi', 'both'], default='both')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--rate-limit', action='store_true', help='Keep the endpoint rate limits on.')
+        parser.add_argument('--output', help='Also write the JSON report to this file.')
+
+    def handle(self, *args, **options):
+        logging.disable(logging.INFO)
+        old_rate_limit, settings.RATE_LIMIT_ENABLED = settings.RATE_LIMIT_ENABLED, options['rate_limit']
+        try:
+            with bench.bench_database():
+                self.rng = random.Random(options['seed'])
+                self.seed(options)
+                report = {'config': self.get_config(options)}
+                servers = ['wsgi', 'asgi'] if options['server'] == 'both' else [options['server']]
+                for server in servers:
+                    report[server] = asyncio.run(self.run(server, options))
+        finally:
+            settings.RATE_LIMIT_ENABLED = old_rate_limit
+            logging.disable(logging.NOTSET)
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output)
+        self.stdout.write(output)
+
+    def get_config(self, options) -> Dict:
+        keys = ['users', 'votings', 'questions', 'variants', 'votes', 'requests', 'concurrency', 'seed', 'rate_limit']
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True)
+        return {
+            **{key: options[key] for key in keys},
+            'commit': commit.stdout.strip() or None,
+            'async_views': settings.ASYNC_VIEWS,
+            'database_profile': settings.DATABASE_PROFILE,
+            'database': settings.DATABASES['default']['ENGINE'],
+            'conn_max_age': settings.DATABASES['default'].get('CONN_MAX_AGE', 0),
+        }
+
+    def seed(self, options):
+        User = get_user_model()
+        password = make_password(None)
+        users = User.objects.bulk_create(
+            [User(username=f'bench{i}', password=password) for i in range(options['users'])], batch_size=1000
+        )
+        votings = Voting.objects.bulk_create(
+            [Voting(title=f'Voting {i}', author=self.rng.choice(users), published=True)
+             for i in range(options['votings'])]
+        )
+        questions = Question.objects.bulk_create(
+            [Question(title=f'Question {j}', description='', voting=voting, type=2)
+             for voting in votings for j in range(options['questions'])]
+        )
+        variants = Variant.objects.bulk_create(
+            [Variant(text=f'Variant {k}', question=question) for question in questions
+             for k in range(options['variants'])],
+            batch_size=1000,
+        )
+        question_variants = {question.id: [] for question in questions}
+        for variant in variants:
+            question_variants[variant.question_id].append(variant.id)
+        self.variants = {voting.id: [] for voting in votings}
+        for question in questions:
+            self.variants[question.voting_id].append(question_variants[question.id])
+        pairs = [(user.id, voting.id) for user in users for voting in votings]
+        self.rng.shuffle(pairs)
+        voted, self.unvoted = pairs[:options['votes']], iter(pairs[options['votes']:])
+        Participation.objects.bulk_create(
+            [Participation(user_id=user_id, voting_id=voting_id) for user_id, voting_id in voted], batch_size=1000
+        )
+        VoteFact.add_votes([
+            VoteFact(user_id=user_id, variant_id=variant_id)
+            for user_id, voting_id in voted for variant_id in self.choose_variants(self.rng, voting_id)
+        ])
+        UserActivity.rebuild()
+        ranking.rebuild(Voting, Participation, Like)
+        self.voted = voted
+        self.voting_ids = [voting.id for voting in votings]
+        self.sessions = {}
+        for user in users:
+            client = Client()
+            client.force_login(user)
+            self.sessions[user.id] = client.cookies[settings.SESSION_COOKIE_NAME].value
+        self.csrf_token = get_random_string(32)
+
+    def choose_variants(self, rng: random.Random, voting_id: int) -> List[int]:
+        return [rng.choice(question_variants) for question_variants in self.variants[voting_id]]
+
+    def headers(self, user_id: int) -> Dict[str, str]:
+        return {
+            'Cookie': f'{settings.SESSION_COOKIE_NAME}={self.sessions[user_id]}; '
+                      f'{settings.CSRF_COOKIE_NAME}={self.csrf_token}',
+            'X-CSRFToken': self.csrf_token,
+        }
+
+    def make_request(self, name: str, i: int):
+        rng = random.Random(i)
+        user_id = rng.choice(list(self.sessions))
+        voting_id = rng.choice(self.voting_ids)
+        if name == 'list_votings':
+            return 'GET', '/votings/list/', {}, user_id
+        if name == 'voting':
+            return 'GET', f'/votings/{voting_id}/', {}, user_id
+        if name == 'results':
+            user_id, voting_id = rng.choice(self.voted)
+            return 'GET', f'/votings/{voting_id}/', {}, user_id
+        if name == 'vote':
+            user_id, voting_id = next(self.unvoted, (user_id, voting_id))
+            return 'POST', f'/votings/{voting_id}/', {'variant_id': self.choose_variants(rng, voting_id)}, user_id
+        return 'POST', f'/votings/{voting_id}/like/', {}, user_id
+
+    def wsgi_send(self, application, method: str, path: str, body: bytes, headers: Dict[str, str]) -> int:
+        environ = {
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.input': io.BytesIO(body),
+            **{'HTTP_' + key.upper().replace('-', '_'): value for key, value in headers.items()},
+        }
+        setup_testing_defaults(environ)
+        status = []
+        response = application(environ, lambda line, response_headers, exc_info=None: status.append(line))
+        try:
+            for _ in response:
+                pass
+        finally:
+            response.close()
+        return int(status[0].split()[0])
+
+    async def asgi_send(self, application, method: str, path: str, body: bytes, headers: Dict[str, str]) -> int:
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': method,
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': b'',
+            'root_path': '',
+            'headers': [
+                (b'host', b'127.0.0.1'),
+                (b'content-type', b'application/x-www-form-urlencoded'),
+                (b'content-length', str(len(body)).encode()),
+                *((key.lower().encode(), value.encode()) for key, value in headers.items()),
+            ],
+            'client': ('127.0.0.1', 0),
+            'server': ('127.0.0.1', 80),
+        }
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        status = []
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            await asyncio.Future()
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+
+        await application(scope, receive, send)
+        return status[0]
+
+    async def run(self, server: str, options) -> Dict:
+        if server == 'wsgi':
+            from votings.wsgi import application
+
+            executor = ThreadPoolExecutor(options['concurrency'])
+            loop = asyncio.get_running_loop()
+
+            async def send(*args) -> int:
+                return await loop.run_in_executor(executor, self.wsgi_send, application, *args)
+        else:
+            from votings.asgi import application
+
+            async def send(*args) -> int:
+                return await self.asgi_send(application, *args)
+
+        def make_call(name: str):
+            async def call(i: int) -> bool:
+                method, path, data, user_id = self.make_request(name, i)
+                status = await send(method, path, urlencode(data, doseq=True).encode(), self.headers(user_id))
+                return status < 400
+
+            return call
+
+        calls = {name: make_call(name) for name in WEIGHTS}
+        try:
+            return await bench.run_mix(calls, WEIGHTS, options['requests'], options['concurrency'], options['seed'])
+        finally:
+            # Persistent connections of the worker threads must go before the test database does.
+            if server == 'wsgi':
+                barrier = threading.Barrier(options['concurrency'])
+
+                def close_connections(_):
+                    barrier.wait()
+                    connections.close_all()
+
+                list(executor.map(close_connections, range(options['concurrency'])))
+                executor.shutdown()
+            else:
+                await sync_to_async(connections.close_all)()
@@ -0,0 +1,272 @@
+import bisect
+import itertools
+import random
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import Iterable, Iterator, List, Sequence, Tuple
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from main import ranking, search
+from main.models import Like, Participation, Question, UserActivity, Variant, VoteFact, Voting
+
+
+def zipf_cum_weights(count: int, exponent: float) -> List[float]:
+    return list(itertools.accumulate(1 / rank ** exponent for rank in range(1, count + 1)))
+
+
+def zipf_shares(total: int, count: int, exponent: float) -> List[int]:
+    weights = zipf_cum_weights(count, exponent)
+    return [round(total * (weights[i] - (weights[i - 1] if i else 0)) / weights[-1]) for i in range(count)]
+
+
+def zipf_sample(rng: random.Random, population: Sequence, cum_weights: List[float], k: int) -> List:
+    # Distinct items by rank weight, draws that hit an already chosen item are repeated.
+    chosen = set()
+    while len(chosen) < k:
+        chosen.add(bisect.bisect(cum_weights, rng.random() * cum_weights[-1]))
+    return [population[i] for i in sorted(chosen)]
+
+
+def batched(rows: Iterable, size: int) -> Iterator[List]:
+    iterator = iter(rows)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+@contextmanager
+def deferred_indexes(models):
+    # Secondary indexes are dropped for the load and rebuilt in one pass afterwards. Indexes
+    # backing table constraints (SQLite autoindexes, PostgreSQL constraints) cannot be dropped alone,
+    # unique indexes are kept so that they still reject duplicates during the load.
+    tables = [model._meta.db_table for model in models]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(
+                f'SELECT name, sql FROM sqlite_master WHERE type = %s AND sql IS NOT NULL '
+                f'AND sql NOT LIKE %s AND tbl_name IN ({", ".join(["%s"] * len(tables))})',
+                ['index', 'CREATE UNIQUE INDEX%', *tables],
+            )
+        elif connection.vendor == 'postgresql':
+            cursor.execute(
+                'SELECT indexname, indexdef FROM pg_indexes i WHERE tablename = ANY(%s) '
+                'AND indexdef NOT LIKE %s '
+                'AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conname = i.indexname)',
+                [tables, 'CREATE UNIQUE INDEX%'],
+            )
+        indexes = cursor.fetchall() if connection.vendor in ('sqlite', 'postgresql') else []
+        for name, _ in indexes:
+            cursor.execute(f'DROP INDEX {connection.ops.quote_name(name)}')
+    try:
+        yield indexes
+    finally:
+        with connection.cursor() as cursor:
+            for _, sql in indexes:
+                cursor.execute(sql)
+
+
+class Progress:
+    def __init__(self, stdout, label: str, total: int):
+        self.stdout = stdout
+        self.label = label
+        self.total = total
+        self.done = 0
+        self.start = self.reported = time.monotonic()
+
+    def advance(self, count: int):
+        self.done += count
+        now = time.monotonic()
+        if now - self.reported >= 1 or self.done >= self.total:
+            self.reported = now
+            rate = self.done / max(now - self.start, 1e-9)
+            self.stdout.write(f'{self.label}: {self.done}/{self.total} ({rate:.0f} rows/s)')
+            self.stdout.flush()
+
+
+class Command(BaseCommand):
+    help = 'Bulk load a deterministic synthetic dataset with popular votings and Zipf distributed choices.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--votings', type=int, default=1000)
+        parser.add_argument('--max-questions', type=int, default=5)
+        parser.add_argument('--max-variants', type=int, default=8)
+        parser.add_argument('--votes', type=int, default=100000, help='Number of ballots, each answers every question.')
+        parser.add_argument('--likes', type=int, default=50000)
+        parser.add_argument('--multiple-choice', type=float, default=0.3, help='Share of multiple choice questions.')
+        parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent of voting popularity and choices.')
+        parser.add_argument('--days', type=int, default=365, help='Spread voting creation over this many days.')
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--keep-indexes', action='store_true', help='Do not defer the vote and like indexes.')
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.rng = random.Random(options['seed'])
+        self.prefix = f'gen{options["seed"]}_'
+        if get_user_model().objects.filter(username__startswith=self.prefix).exists():
+            raise CommandError(f'Users {self.prefix}* already exist, pick another --seed.')
+        start = time.monotonic()
+        user_ids = self.create_users()
+        voting_ids = self.create_votings(user_ids)
+        variants = self.create_questions(voting_ids)
+        models = [] if options['keep_indexes'] else [VoteFact, Participation, Like]
+        with deferred_indexes(models) as indexes:
+            self.create_votes(user_ids, voting_ids, variants)
+            self.create_likes(user_ids, voting_ids)
+            if indexes:
+                self.stdout.write(f'Rebuilding {len(indexes)} indexes...')
+        self.stdout.write('Rebuilding profile activity and rankings...')
+        UserActivity.rebuild()
+        ranking.rebuild(Voting, Participation, Like)
+        progress = Progress(self.stdout, 'search index', len(voting_ids))
+        for voting_id in voting_ids:
+            search.get_backend().index_voting(voting_id)
+            progress.advance(1)
+        self.stdout.write(self.style.SUCCESS(f'Generated dataset in {time.monotonic() - start:.1f}s.'))
+
+    def insert(self, model, columns: List[str], rows: Iterable[Tuple], total: int, label: str):
+        sql = self.insert_sql(model, columns)
+        progress = Progress(self.stdout, label, total)
+        for batch in batched(rows, self.options['batch_size']):
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(sql, batch)
+            progress.advance(len(batch))
+
+    def update_column(self, model, column: str, values: Iterable[Tuple]):
+        table = connection.ops.quote_name(model._meta.db_table)
+        sql = f'UPDATE {table} SET {connection.ops.quote_name(column)} = %s WHERE id = %s'
+        for batch in batched(values, self.options['batch_size']):
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(sql, batch)
+
+    def create_users(self) -> List[int]:
+        User = get_user_model()
+        password = make_password(None)
+        progress = Progress(self.stdout, 'users', self.options['users'])
+        user_ids = []
+        users = (User(username=f'{self.prefix}{i}', password=password) for i in range(self.options['users']))
+        for batch in batched(users, self.options['batch_size']):
+            user_ids.extend(user.id for user in User.objects.bulk_create(batch))
+            progress.advance(len(batch))
+        return user_ids
+
+    def create_votings(self, user_ids: List[int]) -> List[int]:
+        votings = [
+            Voting(title=f'Voting {self.prefix}{i}', author_id=self.rng.choice(user_ids), published=True)
+            for i in range(self.options['votings'])
+        ]
+        votings = Voting.objects.bulk_create(votings, batch_size=self.options['batch_size'])
+        voting_ids = [voting.id for voting in votings]
+        now, period = timezone.now(), self.options['days'] * 86400
+        created = (
+            (self.adapt_datetime(now - timedelta(seconds=self.rng.uniform(0, period))), voting_id)
+            for voting_id in voting_ids
+        )
+        self.update_column(Voting, 'created_at', created)
+        self.stdout.write(f'votings: {len(voting_ids)}')
+        return voting_ids
+
+    def create_questions(self, voting_ids: List[int]) -> dict:
+        questions = [
+            Question(
+                title=f'Question {j}',
+                description=f'Question {j} of voting {voting_id}',
+                voting_id=voting_id,
+                type=2 if self.rng.random() < self.options['multiple_choice'] else 1,
+            )
+            for voting_id in voting_ids for j in range(self.rng.randint(1, self.options['max_questions']))
+        ]
+        questions = Question.objects.bulk_create(questions, batch_size=self.options['batch_size'])
+        variants = [
+            Variant(text=f'Variant {k}', question=question)
+            for question in questions for k in range(self.rng.randint(2, self.options['max_variants']))
+        ]
+        variants = Variant.objects.bulk_create(variants, batch_size=self.options['batch_size'])
+        by_question = {question.id: (question.type, []) for question in questions}
+        for variant in variants:
+            by_question[variant.question_id][1].append(variant.id)
+        by_voting = {voting_id: [] for voting_id in voting_ids}
+        for question in questions:
+            by_voting[question.voting_id].append((question.id, *by_question[question.id]))
+        self.stdout.write(f'questions: {len(questions)}, variants: {len(variants)}')
+        return by_voting
+
+    def popular(self, total: int, voting_ids: List[int]) -> Iterator[Tuple[int, int]]:
+        # Zipf popularity over votings in random order, at most one row per user and voting.
+        ranked = list(voting_ids)
+        self.rng.shuffle(ranked)
+        users = self.options['users']
+        for voting_id, count in zip(ranked, zipf_shares(total, len(ranked), self.options['skew'])):
+            if count:
+                yield voting_id, min(count, users)
+
+    def create_votes(self, user_ids: List[int], voting_ids: List[int], variants: dict):
+        plan = list(self.popular(self.options['votes'], voting_ids))
+        total = sum(count for _, count in plan)
+        cum_weights = zipf_cum_weights(self.options['max_variants'], self.options['skew'])
+        variant_counts, question_counts = [], []
+        now = self.adapt_datetime(timezone.now())
+
+        def ballots() -> Iterator[Tuple[int, int, List[int]]]:
+            for voting_id, count in plan:
+                tally = Counter()
+                for user_id in self.rng.sample(user_ids, count):
+                    chosen = []
+                    for _, question_type, question_variants in variants[voting_id]:
+                        k = 1 if question_type == 1 else self.rng.randint(1, min(3, len(question_variants)))
+                        chosen.extend(zipf_sample(self.rng, question_variants, cum_weights[:len(question_variants)], k))
+                    tally.update(chosen)
+                    yield user_id, voting_id, chosen
+                variant_counts.extend((votes, variant_id) for variant_id, votes in tally.items())
+                question_counts.extend(
+                    (sum(tally[variant_id] for variant_id in question_variants), question_id)
+                    for question_id, _, question_variants in variants[voting_id]
+                )
+
+        participation_sql = self.insert_sql(Participation, ['user_id', 'voting_id', 'created_at'])
+        fact_sql = self.insert_sql(VoteFact, ['user_id', 'variant_id'])
+        progress = Progress(self.stdout, 'ballots', total)
+        for batch in batched(ballots(), self.options['batch_size']):
+            participations = [(user_id, voting_id, now) for user_id, voting_id, _ in batch]
+            facts = [(user_id, variant_id) for user_id, _, chosen in batch for variant_id in chosen]
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(participation_sql, participations)
+                cursor.executemany(fact_sql, facts)
+            progress.advance(len(batch))
+            self.write_counts(variant_counts, question_counts)
+        # The counts of the last voting are added once the generator is exhausted, after the
+        # last batch when the ballots fill it exactly.
+        self.write_counts(variant_counts, question_counts)
+
+    def write_counts(self, variant_counts: List[Tuple[int, int]], question_counts: List[Tuple[int, int]]):
+        self.update_column(Variant, 'votes_count', variant_counts)
+        self.update_column(Question, 'votes_count', question_counts)
+        variant_counts.clear()
+        question_counts.clear()
+
+    def create_likes(self, user_ids: List[int], voting_ids: List[int]):
+        plan = list(self.popular(self.options['likes'], voting_ids))
+        now = self.adapt_datetime(timezone.now())
+        rows = (
+            (user_id, voting_id, True, now)
+            for voting_id, count in plan for user_id in self.rng.sample(user_ids, count)
+        )
+        total = sum(count for _, count in plan)
+        self.insert(Like, ['user_id', 'voting_id', 'active', 'created_at'], rows, total, 'likes')
+
+    @staticmethod
+    def adapt_datetime(value):
+        return connection.ops.adapt_datetimefield_value(value)
+
+    @staticmethod
+    def insert_sql(model, columns: List[str]) -> str:
+        return (
+            f'INSERT INTO {connection.ops.quote_name(model._meta.db_table)} '
+            f'({", ".join(connection.ops.quote_name(column) for column in columns)}) '
+            f'VALUES ({", ".join(["%s"] * len(columns))})'
+        )
@@ -0,0 +1,18 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from main import ranking
+from main.models import Like, Participation, Voting
+
+
+class Command(BaseCommand):
+    help = 'Recompute the trending scores and the like and vote counters of all votings from the raw rows.'
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        with transaction.atomic():
+            scored = ranking.rebuild(Voting, Participation, Like)
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt rankings of {Voting.objects.count()} votings, {scored} with trending scores, '
+            f'in {time.monotonic() - start:.1f}s.'
+        ))
@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from main.models import Question, UserActivity, Variant, VoteFact
+
+
+def count_votes(**filters) -> Coalesce:
+    facts = (
+        VoteFact.objects.filter(**filters)
+        .order_by()
+        .values(*filters.keys())
+        .annotate(count=Count('id'))
+        .values('count')
+    )
+    return Coalesce(Subquery(facts, output_field=IntegerField()), 0)
+
+
+class Command(BaseCommand):
+    help = 'Rebuild or verify the vote tallies and the profile activity counters from the raw rows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Only compare the stored tallies with the vote facts, do not change them.',
+        )
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            self.verify()
+        else:
+            self.rebuild()
+
+    def rebuild(self):
+        with transaction.atomic():
+            variants = Variant.objects.update(votes_count=count_votes(variant=OuterRef('pk')))
+            questions = Question.objects.update(votes_count=count_votes(variant__question=OuterRef('pk')))
+            users = UserActivity.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt tallies of {variants} variants and {questions} questions, activity of {users} users.'
+        ))
+
+    def verify(self):
+        mismatches = 0
+        for model, filters in (
+                (Variant, {'variant': OuterRef('pk')}),
+                (Question, {'variant__question': OuterRef('pk')}),
+        ):
+            wrong = (
+                model.objects.annotate(actual=count_votes(**filters))
+                .exclude(votes_count=F('actual'))
+                .values_list('id', 'votes_count', 'actual')
+            )
+            for id, stored, actual in wrong:
+                mismatches += 1
+                self.stdout.write(f'{model.__name__} {id}: stored {stored}, actual {actual}')
+        for counter, actual_count in UserActivity.get_actual_counts().items():
+            wrong = (
+                UserActivity.objects.annotate(actual=actual_count)
+                .exclude(**{counter: F('actual')})
+                .values_list('user_id', counter, 'actual')
+            )
+            for user_id, stored, actual in wrong:
+                mismatches += 1
+                self.stdout.write(f'UserActivity {user_id} {counter}: stored {stored}, actual {actual}')
+        if mismatches:
+            raise CommandError(f'{mismatches} tallies are out of date, run rebuild_tallies to fix them.')
+        self.stdout.write(self.style.SUCCESS('All tallies are up to date.'))
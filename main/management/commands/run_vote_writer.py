@@ -0,0 +1,20 @@
+import signal
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from main import ingestion
+
+
+class Command(BaseCommand):
+    help = 'Save queued votes in batches until interrupted, then drain the queue.'
+
+    def handle(self, *args, **options):
+        config = settings.VOTE_INGESTION
+        writer = ingestion.VoteWriter(ingestion.get_queue(), config['BATCH_SIZE'], config['FLUSH_INTERVAL'])
+        signal.signal(signal.SIGTERM, lambda *_: writer.stopping.set())
+        self.stdout.write(f'Writing votes from the {config["BACKEND"]} queue.')
+        try:
+            writer.run()
+        except KeyboardInterrupt:
+            writer.stopping.set()
+            writer.run()
+        self.stdout.write(self.style.SUCCESS('Votes queue drained.'))
@@ -0,0 +1,112 @@
+import bisect
+import threading
+import time
+from contextvars import ContextVar
+from typing import List, Optional, Sequence
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float]):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, view: str, value: float):
+        with self.lock:
+            series = self.series.get(view)
+            if series is None:
+                series = self.series[view] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            series = {view: (list(counts), total, count) for view, (counts, total, count) in self.series.items()}
+        for view, (counts, total, count) in sorted(series.items()):
+            label = escape_label(view)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{view="{label}",le="{bound:g}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{view="{label}",le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{view="{label}"}} {total:g}')
+            lines.append(f'{self.name}_count{{view="{label}"}} {count}')
+        return lines
+
+    def reset(self):
+        with self.lock:
+            self.series.clear()
+
+
+def escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+request_duration = Histogram(
+    'votings_request_duration_seconds', 'Total time spent serving a request.', LATENCY_BUCKETS
+)
+request_queries = Histogram('votings_request_queries', 'SQL queries executed per request.', QUERY_BUCKETS)
+request_db_duration = Histogram(
+    'votings_request_db_duration_seconds', 'Time spent in SQL queries per request.', LATENCY_BUCKETS
+)
+request_render_duration = Histogram(
+    'votings_request_render_duration_seconds', 'Time spent rendering templates per request.', LATENCY_BUCKETS
+)
+HISTOGRAMS = [request_duration, request_queries, request_db_duration, request_render_duration]
+
+
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+
+
+# Set by MetricsMiddleware for the duration of a request. Context variables follow the
+# request into sync_to_async threads, where the ORM of async views runs.
+current_stats: ContextVar[Optional[RequestStats]] = ContextVar('current_stats', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    stats = current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.db_time += time.perf_counter() - start
+        stats.queries += 1
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def observe_request(view: str, stats: RequestStats, duration: float):
+    request_duration.observe(view, duration)
+    request_queries.observe(view, stats.queries)
+    request_db_duration.observe(view, stats.db_time)
+    request_render_duration.observe(view, stats.render_time)
+
+
+def render_metrics() -> str:
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    return '\n'.join(lines) + '\n'
+
+
+def reset_metrics():
+    for histogram in HISTOGRAMS:
+        histogram.reset()
@@ -0,0 +1,115 @@
+import logging
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.urls import Resolver404, resolve
+from main import metrics
+from main.db import replica_reads
+
+logger = logging.getLogger('main.metrics')
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = metrics.RequestStats()
+        token = metrics.current_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.current_stats.reset(token)
+        self.record(request, response, stats, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        stats = metrics.RequestStats()
+        token = metrics.current_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.current_stats.reset(token)
+        self.record(request, response, stats, time.perf_counter() - start)
+        return response
+
+    def process_template_response(self, request, response):
+        stats = metrics.current_stats.get()
+        if stats is not None:
+            start = time.perf_counter()
+
+            def rendered(response):
+                stats.render_time += time.perf_counter() - start
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    def record(self, request, response, stats: metrics.RequestStats, duration: float):
+        # Streaming responses are observed once their headers are ready, not when the stream ends.
+        view = request.resolver_match.view_name if request.resolver_match else 'unresolved'
+        metrics.observe_request(view, stats, duration)
+        logger.log(
+            settings.METRICS_LOG_LEVEL,
+            'view=%s method=%s status=%s duration_ms=%.1f queries=%d db_ms=%.1f render_ms=%.1f',
+            view, request.method, response.status_code, duration * 1000, stats.queries, stats.db_time * 1000,
+            stats.render_time * 1000,
+        )
+
+
+class ReplicaMiddleware:
+    # Safe requests to views marked with replica_reads read from a replica, unless the user
+    # wrote something in the last REPLICA_PIN_SECONDS and must see it.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = replica_reads.set(self.reads_from_replica(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            replica_reads.reset(token)
+        return self.pin(request, response)
+
+    async def __acall__(self, request):
+        token = replica_reads.set(self.reads_from_replica(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            replica_reads.reset(token)
+        return self.pin(request, response)
+
+    @staticmethod
+    def reads_from_replica(request) -> bool:
+        if not settings.DATABASE_REPLICA_ALIASES or request.method not in ('GET', 'HEAD'):
+            return False
+        if settings.REPLICA_PIN_COOKIE in request.COOKIES:
+            return False
+        try:
+            view = resolve(request.path_info).func
+        except Resolver404:
+            return False
+        return getattr(getattr(view, 'view_class', view), 'replica_reads', False)
+
+    @staticmethod
+    def pin(request, response):
+        if settings.DATABASE_REPLICA_ALIASES and request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            response.set_cookie(
+                settings.REPLICA_PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax'
+            )
+        return response
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.18 on 2026-10-18 16:56
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_tallies(apps, schema_editor):
+    Question = apps.get_model('main', 'Question')
+    Variant = apps.get_model('main', 'Variant')
+    VoteFact = apps.get_model('main', 'VoteFact')
+
+    def count_votes(**filters):
+        facts = (
+            VoteFact.objects.filter(**filters)
+            .order_by()
+            .values(*filters.keys())
+            .annotate(count=Count('id'))
+            .values('count')
+        )
+        return Coalesce(Subquery(facts, output_field=IntegerField()), 0)
+
+    Variant.objects.update(votes_count=count_votes(variant=OuterRef('pk')))
+    Question.objects.update(votes_count=count_votes(variant__question=OuterRef('pk')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0003_remove_voting_likes_like_active'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='votes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='variant',
+            name='votes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_tallies, migrations.RunPython.noop),
+    ]
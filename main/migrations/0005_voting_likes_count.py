@@ -0,0 +1,34 @@
+# Generated by Django 4.2.18 on 2026-10-18 16:57
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_likes_count(apps, schema_editor):
+    Like = apps.get_model('main', 'Like')
+    Voting = apps.get_model('main', 'Voting')
+    likes = (
+        Like.objects.filter(voting=OuterRef('pk'), active=True)
+        .order_by()
+        .values('voting')
+        .annotate(count=Count('id'))
+        .values('count')
+    )
+    Voting.objects.update(likes_count=Coalesce(Subquery(likes, output_field=IntegerField()), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_question_votes_count_variant_votes_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='voting',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_likes_count, migrations.RunPython.noop),
+    ]
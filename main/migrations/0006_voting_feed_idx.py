@@ -0,0 +1,17 @@
+# Generated by Django 4.2.18 on 2026-10-18 16:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_voting_likes_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='voting',
+            index=models.Index(fields=['published', 'blocked', 'created_at'], name='voting_feed_idx'),
+        ),
+    ]
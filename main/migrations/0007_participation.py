@@ -0,0 +1,45 @@
+# Generated by Django 4.2.18 on 2026-10-18 16:59
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_participations(apps, schema_editor):
+    Participation = apps.get_model('main', 'Participation')
+    VoteFact = apps.get_model('main', 'VoteFact')
+    pairs = (
+        VoteFact.objects.filter(user__isnull=False)
+        .values_list('user_id', 'variant__question__voting_id')
+        .distinct()
+        .iterator()
+    )
+    Participation.objects.bulk_create(
+        (Participation(user_id=user_id, voting_id=voting_id) for user_id, voting_id in pairs),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('main', '0006_voting_feed_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Participation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('voting', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.voting')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='participation',
+            constraint=models.UniqueConstraint(fields=('user', 'voting'), name='unique_participation'),
+        ),
+        migrations.RunPython(fill_participations, migrations.RunPython.noop),
+    ]
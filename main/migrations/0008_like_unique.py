@@ -0,0 +1,42 @@
+# Generated by Django 4.2.18 on 2026-10-18 17:01
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def remove_duplicate_likes(apps, schema_editor):
+    Like = apps.get_model('main', 'Like')
+    Voting = apps.get_model('main', 'Voting')
+    duplicates = (
+        Like.objects.values('user', 'voting')
+        .annotate(count=Count('id'), last_id=Max('id'))
+        .filter(count__gt=1)
+    )
+    for duplicate in duplicates.iterator():
+        Like.objects.filter(user=duplicate['user'], voting=duplicate['voting']).exclude(
+            id=duplicate['last_id']
+        ).delete()
+    likes = (
+        Like.objects.filter(voting=OuterRef('pk'), active=True)
+        .order_by()
+        .values('voting')
+        .annotate(count=Count('id'))
+        .values('count')
+    )
+    Voting.objects.update(likes_count=Coalesce(Subquery(likes, output_field=IntegerField()), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_participation'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_likes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='like',
+            constraint=models.UniqueConstraint(fields=('user', 'voting'), name='unique_like'),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 4.2.18 on 2026-10-18 17:02
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def remove_duplicate_vote_facts(apps, schema_editor):
+    Question = apps.get_model('main', 'Question')
+    Variant = apps.get_model('main', 'Variant')
+    VoteFact = apps.get_model('main', 'VoteFact')
+    duplicates = (
+        VoteFact.objects.filter(user__isnull=False)
+        .values('user', 'variant')
+        .annotate(count=Count('id'), last_id=Max('id'))
+        .filter(count__gt=1)
+    )
+    removed = 0
+    for duplicate in duplicates.iterator():
+        removed += VoteFact.objects.filter(user=duplicate['user'], variant=duplicate['variant']).exclude(
+            id=duplicate['last_id']
+        ).delete()[0]
+    if not removed:
+        return
+
+    def count_votes(**filters):
+        facts = (
+            VoteFact.objects.filter(**filters)
+            .order_by()
+            .values(*filters.keys())
+            .annotate(count=Count('id'))
+            .values('count')
+        )
+        return Coalesce(Subquery(facts, output_field=IntegerField()), 0)
+
+    Variant.objects.update(votes_count=count_votes(variant=OuterRef('pk')))
+    Question.objects.update(votes_count=count_votes(variant__question=OuterRef('pk')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_like_unique'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='complaint',
+            index=models.Index(fields=['is_active'], name='complaint_active_idx'),
+        ),
+        migrations.RunPython(remove_duplicate_vote_facts, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='votefact',
+            constraint=models.UniqueConstraint(fields=('user', 'variant'), name='unique_vote_fact'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.18 on 2026-10-18 17:20
+
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        'CREATE VIRTUAL TABLE IF NOT EXISTS main_voting_fts USING fts5(title, questions, tokenize="unicode61")'
+    )
+    schema_editor.execute(
+        'CREATE VIRTUAL TABLE IF NOT EXISTS main_complaint_fts USING fts5(text, tokenize="unicode61")'
+    )
+    schema_editor.execute(
+        '''
+        INSERT INTO main_voting_fts (rowid, title, questions)
+        SELECT v.id, v.title, coalesce(group_concat(q.title || ' ' || q.description, ' '), '')
+        FROM main_voting v LEFT JOIN main_question q ON q.voting_id = v.id
+        WHERE v.published = 1 AND v.blocked = 0
+        GROUP BY v.id
+        '''
+    )
+    schema_editor.execute(
+        'INSERT INTO main_complaint_fts (rowid, text) SELECT id, text FROM main_complaint WHERE is_active = 1'
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE IF EXISTS main_voting_fts')
+    schema_editor.execute('DROP TABLE IF EXISTS main_complaint_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
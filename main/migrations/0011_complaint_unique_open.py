@@ -0,0 +1,40 @@
+# Generated by Django 4.2.18 on 2026-10-18 17:12
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def close_duplicate_complaints(apps, schema_editor):
+    Complaint = apps.get_model('main', 'Complaint')
+    duplicates = (
+        Complaint.objects.filter(is_active=True)
+        .values('user', 'voting')
+        .annotate(count=Count('id'), last_id=Max('id'))
+        .filter(count__gt=1)
+    )
+    closed_ids = []
+    for duplicate in duplicates.iterator():
+        complaints = Complaint.objects.filter(
+            user=duplicate['user'], voting=duplicate['voting'], is_active=True
+        ).exclude(id=duplicate['last_id'])
+        closed_ids.extend(complaints.values_list('id', flat=True))
+        complaints.update(is_active=False)
+    if closed_ids and schema_editor.connection.vendor == 'sqlite':
+        with schema_editor.connection.cursor() as cursor:
+            for complaint_id in closed_ids:
+                cursor.execute('DELETE FROM main_complaint_fts WHERE rowid = %s', [complaint_id])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(close_duplicate_complaints, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='complaint',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_active', True)), fields=('user', 'voting'), name='unique_open_complaint'),
+        ),
+    ]
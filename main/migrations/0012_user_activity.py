@@ -0,0 +1,53 @@
+# Generated by Django 4.2.18 on 2026-10-18 17:31
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def count_rows(model, **filters):
+    rows = model.objects.filter(**filters).order_by().values(*filters.keys()).annotate(count=Count('id'))
+    return Coalesce(Subquery(rows.values('count'), output_field=IntegerField()), 0)
+
+
+def fill_user_activity(apps, schema_editor):
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    UserActivity = apps.get_model('main', 'UserActivity')
+    Voting = apps.get_model('main', 'Voting')
+    Like = apps.get_model('main', 'Like')
+    Participation = apps.get_model('main', 'Participation')
+    UserActivity.objects.bulk_create(
+        (UserActivity(user_id=user_id) for user_id in User.objects.values_list('id', flat=True).iterator()),
+        batch_size=1000,
+    )
+    user = OuterRef('user_id')
+    UserActivity.objects.update(
+        votings_count=count_rows(Voting, author=user),
+        published_count=count_rows(Voting, author=user, published=True),
+        liked_count=count_rows(Like, user=user, active=True),
+        voted_count=count_rows(Participation, user=user),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('main', '0011_complaint_unique_open'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserActivity',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='activity', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('votings_count', models.PositiveIntegerField(default=0)),
+                ('published_count', models.PositiveIntegerField(default=0)),
+                ('liked_count', models.PositiveIntegerField(default=0)),
+                ('voted_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(fill_user_activity, migrations.RunPython.noop),
+    ]
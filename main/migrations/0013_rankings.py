@@ -0,0 +1,86 @@
+# Generated by Django 4.2.18 on 2026-10-18 17:48
+
+from collections import defaultdict
+import math
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce, TruncHour
+import django.utils.timezone
+
+# The ranking settings as of this migration, see main.ranking for the score.
+HALF_LIFE_HOURS = 24
+WEIGHTS = {'vote': 1.0, 'like': 0.5}
+
+
+def count_per_voting(model, **filters):
+    rows = model.objects.filter(voting=OuterRef('pk'), **filters).order_by().values('voting')
+    rows = rows.annotate(count=Count('id'))
+    return Coalesce(Subquery(rows.values('count'), output_field=IntegerField()), 0)
+
+
+def add_weight(score, weight, at):
+    exponent = at - score
+    if exponent > 0:
+        return at + math.log2(weight + 2 ** -exponent)
+    return score + math.log2(1 + weight * 2 ** exponent)
+
+
+def fill_rankings(apps, schema_editor):
+    Voting = apps.get_model('main', 'Voting')
+    Participation = apps.get_model('main', 'Participation')
+    Like = apps.get_model('main', 'Like')
+    Voting.objects.update(
+        votes_count=count_per_voting(Participation),
+        likes_count=count_per_voting(Like, active=True),
+        trending_score=0,
+    )
+    scores = defaultdict(float)
+    for event, rows in (('vote', Participation.objects.all()), ('like', Like.objects.filter(active=True))):
+        hours = rows.annotate(hour=TruncHour('created_at')).order_by().values('voting_id', 'hour').annotate(
+            count=Count('id')
+        )
+        for row in hours.iterator():
+            at = row['hour'].timestamp() / (HALF_LIFE_HOURS * 60 * 60)
+            scores[row['voting_id']] = add_weight(scores[row['voting_id']], WEIGHTS[event] * row['count'], at)
+    Voting.objects.bulk_update(
+        [Voting(id=id, trending_score=score) for id, score in scores.items()], ['trending_score'], batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_user_activity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='like',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='voting',
+            name='trending_score',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='voting',
+            name='votes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='voting',
+            index=models.Index(fields=['published', 'blocked', 'trending_score'], name='voting_trending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voting',
+            index=models.Index(fields=['published', 'blocked', 'likes_count'], name='voting_liked_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voting',
+            index=models.Index(fields=['published', 'blocked', 'votes_count'], name='voting_voted_idx'),
+        ),
+        migrations.RunPython(fill_rankings, migrations.RunPython.noop),
+    ]
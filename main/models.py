@@ -1,6 +1,14 @@
-from typing import List
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, Count, Exists, F, FloatField, IntegerField, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from main import ranking
+from main.db import primary_reads
+from main.signals import complaints_closed, votes_cast, voting_blocked, voting_liked
 
 
 class Voting(models.Model):
@@ -9,48 +17,167 @@ class Voting(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     blocked = models.BooleanField(default=False)
     published = models.BooleanField(default=False)
+    likes_count = models.PositiveIntegerField(default=0)
+    votes_count = models.PositiveIntegerField(default=0)
+    trending_score = models.FloatField(default=0)
 
-    def like(self, user: get_user_model):
-        like, created = Like.objects.get_or_create(user=user, voting=self)
-        if not created:
-            like.active = not like.active
-            like.save()
+    class Meta:
+        indexes = [
+            models.Index(fields=['published', 'blocked', 'created_at'], name='voting_feed_idx'),
+            models.Index(fields=['published', 'blocked', 'trending_score'], name='voting_trending_idx'),
+            models.Index(fields=['published', 'blocked', 'likes_count'], name='voting_liked_idx'),
+            models.Index(fields=['published', 'blocked', 'votes_count'], name='voting_voted_idx'),
+        ]
+
+    def like(self, user: get_user_model) -> bool:
+        likes = Like.objects.filter(user=user, voting=self)
+        # A like made again counts from now, so that its unlike takes back the same weight.
+        toggle = {
+            'active': ~F('active'),
+            'created_at': Case(When(active=False, then=Value(timezone.now())), default=F('created_at')),
+        }
+        with transaction.atomic():
+            if not likes.update(**toggle):
+                try:
+                    with transaction.atomic():
+                        Like.objects.create(user=user, voting=self)
+                except IntegrityError:
+                    likes.update(**toggle)
+            # Reads the like state with the counters that add_to_rankings would read anyway.
+            likes_count, trending_score, liked, liked_at = Voting.objects.select_for_update().filter(
+                id=self.id
+            ).annotate(
+                liked=Exists(likes.filter(active=True)),
+                liked_at=Subquery(likes.values('created_at')[:1]),
+            ).values_list('likes_count', 'trending_score', 'liked', 'liked_at').get()
+            delta = 1 if liked else -1
+            counts = Voting.add_to_rankings(
+                'like', {self.id: delta}, {self.id: (likes_count, trending_score)}, ranking.clock(liked_at.timestamp())
+            )
+            UserActivity.add('liked_count', {user.id: delta})
+            voting_liked.send(sender=Voting, voting_ids=[self.id])
+        self.likes_count = counts[self.id]
+        return liked
+
+    def vote(self, user: get_user_model, variant_ids: Iterable) -> bool:
+        variants = self.get_chosen_variants(variant_ids)
+        try:
+            with transaction.atomic():
+                Participation.objects.create(user=user, voting=self)
+                VoteFact.add_votes([VoteFact(user=user, variant=variant) for variant in variants])
+                Voting.add_to_rankings('vote', {self.id: 1})
+                UserActivity.add('voted_count', {user.id: 1})
+                votes_cast.send(sender=Voting, votes={self.id: Counter(variant.id for variant in variants)})
+        except IntegrityError:
+            return False
+        return True
+
+    def get_chosen_variants(self, variant_ids: Iterable) -> List:
+        if not self.published or self.blocked:
+            raise ValidationError('Voting is not open.')
+        try:
+            ids = {int(variant_id) for variant_id in variant_ids}
+        except (TypeError, ValueError):
+            raise ValidationError('Invalid variant id.')
+        if not ids:
+            raise ValidationError('No variants chosen.')
+        variants = list(Variant.objects.filter(id__in=ids, question__voting=self).select_related('question'))
+        if len(variants) != len(ids):
+            raise ValidationError('Variant does not belong to this voting.')
+        chosen = Counter(variant.question_id for variant in variants if variant.question.type == 1)
+        if any(count > 1 for count in chosen.values()):
+            raise ValidationError('Only one variant can be chosen in a single choice question.')
+        return variants
 
     def is_user_voted(self, user: get_user_model) -> bool:
-        return VoteFact.objects.filter(user=user).filter(variant__question__voting=self).exists()
+        return Participation.objects.filter(user=user, voting=self).exists()
 
     def publish(self):
-        self.published = True
-        self.save()
+        was_published, self.published = self.published, True
+        with transaction.atomic():
+            self.save(update_fields=['published'])
+            if not was_published:
+                UserActivity.add('published_count', {self.author_id: 1})
 
     @staticmethod
     def get_active_votings() -> List:
-        return Voting.objects.filter(blocked=False).filter(published=True).all()
+        # Compare with literal values, otherwise SQLite gets "NOT blocked AND published"
+        # and cannot use voting_feed_idx.
+        return Voting.objects.filter(blocked=Value(False), published=Value(True)).select_related('author').all()
+
+    @staticmethod
+    def add_to_rankings(event: str, counts: Dict[int, int], current: Optional[Dict[int, Tuple[int, float]]] = None,
+                        at: Optional[float] = None) -> Dict[int, int]:
+        # Adds to likes_count or votes_count and to the trending score, returns the new counts
+        # when the row was read. Runs in the transaction of the like or vote after its first
+        # write, so SQLite reads the row under the write lock, as must a given current row.
+        counts = {id: count for id, count in counts.items() if count}
+        if not counts:
+            return {}
+        counter = f'{event}s_count'
+        updates = {
+            counter: F(counter) + Case(
+                *[When(id=id, then=Value(count)) for id, count in counts.items()],
+                default=Value(0),
+                output_field=IntegerField(),
+            ),
+        }
+        weight = ranking.get_weight(event)
+        if weight and current is None:
+            current = {
+                id: (count, score) for id, count, score in Voting.objects.select_for_update().filter(
+                    id__in=counts.keys()
+                ).values_list('id', counter, 'trending_score')
+            }
+        if weight:
+            scores = ranking.add_weights(
+                {id: score for id, (_, score) in current.items()},
+                {id: count * weight for id, count in counts.items()},
+                ranking.clock() if at is None else at,
+            )
+            updates['trending_score'] = Case(
+                *[When(id=id, then=Value(score)) for id, score in scores.items()],
+                default=F('trending_score'),
+                output_field=FloatField(),
+            )
+        Voting.objects.filter(id__in=counts.keys()).update(**updates)
+        return {id: count + counts.get(id, 0) for id, (count, _) in (current or {}).items()}
 
     def get_questions(self) -> List:
         return Question.objects.filter(voting=self).all()
 
     @staticmethod
     def get_votings_of_user(user: get_user_model) -> List:
-        return Voting.objects.filter(author=user).all()
+        return Voting.objects.filter(author=user).select_related('author').all()
 
     @staticmethod
     def get_voted_votings(user: get_user_model) -> List:
-        votings = {
-            vote_fact.variant.question.voting for vote_fact in VoteFact.objects.filter(user=user).all()
-        }
-        return list(votings)
+        return Voting.objects.filter(participation__user=user).select_related('author').all()
 
     @staticmethod
     def get_liked_votings(user: get_user_model) -> List:
-        return Voting.objects.filter(like__user=user, like__active=True).all()
+        return Voting.objects.filter(like__user=user, like__active=True).select_related('author').all()
 
     def get_likes_count(self) -> int:
-        return Like.objects.filter(voting=self, active=True).count()
+        return self.likes_count
 
     def is_user_liked(self, user: get_user_model) -> bool:
         return Like.objects.filter(user=user, voting=self, active=True).exists()
 
+    @staticmethod
+    def get_liked_ids(user: get_user_model, voting_ids: Iterable) -> Set[int]:
+        return set(
+            Like.objects.filter(user=user, voting_id__in=voting_ids, active=True).values_list('voting_id', flat=True)
+        )
+
+    @staticmethod
+    def get_liked_and_voted_ids(user: get_user_model, voting_ids: Iterable) -> Tuple[Set[int], Set[int]]:
+        voting_ids = list(voting_ids)
+        liked = Like.objects.filter(user=user, voting_id__in=voting_ids, active=True).values_list('voting_id', Value(1))
+        voted = Participation.objects.filter(user=user, voting_id__in=voting_ids).values_list('voting_id', Value(2))
+        rows = list(liked.union(voted, all=True))
+        return {id for id, kind in rows if kind == 1}, {id for id, kind in rows if kind == 2}
+
 
 class Question(models.Model):
     QUESTION_TYPES = [
@@ -62,38 +189,139 @@ class Question(models.Model):
     description = models.TextField()
     voting = models.ForeignKey(Voting, on_delete=models.CASCADE)
     type = models.IntegerField(choices=QUESTION_TYPES)
+    votes_count = models.PositiveIntegerField(default=0)
 
     def get_variants(self) -> List:
-        return Variant.objects.filter(question=self).all()
+        return Variant.objects.filter(question=self).select_related('question').all()
 
 
 class Variant(models.Model):
     text = models.CharField(max_length=100)
     question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    votes_count = models.PositiveIntegerField(default=0)
 
     def is_user_voted(self, user: get_user_model) -> bool:
         return VoteFact.objects.filter(user=user).filter(variant=self).exists()
 
     def calculate_votes(self) -> int:
-        count = VoteFact.objects.filter(variant=self).count()
-        total_count = VoteFact.objects.filter(variant__question=self.question).count()
-        return int(count / total_count * 100) if total_count != 0 else 0
+        total_count = self.question.votes_count
+        return int(self.votes_count / total_count * 100) if total_count != 0 else 0
 
 
 class VoteFact(models.Model):
     user = models.ForeignKey(get_user_model(), on_delete=models.SET_NULL, null=True)
     variant = models.ForeignKey(Variant, on_delete=models.CASCADE)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'variant'], name='unique_vote_fact'),
+        ]
+
+    @staticmethod
+    def add_votes(vote_facts: List):
+        VoteFact.objects.bulk_create(vote_facts)
+        VoteFact._increment_votes(Variant, Counter(fact.variant_id for fact in vote_facts))
+        VoteFact._increment_votes(Question, Counter(fact.variant.question_id for fact in vote_facts))
+
     @staticmethod
-    def vote(user: get_user_model, variant: Variant):
-        obj = VoteFact.objects.create(user=user, variant=variant)
-        obj.save()
+    def _increment_votes(model, counts: Counter):
+        if not counts:
+            return
+        delta = Case(
+            *[When(id=id, then=Value(count)) for id, count in counts.items()],
+            output_field=models.PositiveIntegerField(),
+        )
+        model.objects.filter(id__in=counts.keys()).update(votes_count=F('votes_count') + delta)
+
+
+class Participation(models.Model):
+    user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE)
+    voting = models.ForeignKey(Voting, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'voting'], name='unique_participation'),
+        ]
+
+    @staticmethod
+    def get_voted_by(user: get_user_model) -> List:
+        return Participation.objects.filter(user=user).select_related('voting__author').all()
 
 
 class Like(models.Model):
     user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE)
     voting = models.ForeignKey(Voting, on_delete=models.CASCADE)
     active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'voting'], name='unique_like'),
+        ]
+
+    @staticmethod
+    def get_liked_by(user: get_user_model) -> List:
+        return Like.objects.filter(user=user, active=Value(True)).select_related('voting__author').all()
+
+
+def count_rows(model, **filters) -> Coalesce:
+    rows = model.objects.filter(**filters).order_by().values(*filters.keys()).annotate(count=Count('id'))
+    return Coalesce(Subquery(rows.values('count'), output_field=IntegerField()), 0)
+
+
+class UserActivity(models.Model):
+    # Profile counters, kept up to date by the writes that change them. The voting lists
+    # themselves are read page by page from the indexed Voting, Like and Participation tables.
+    user = models.OneToOneField(get_user_model(), on_delete=models.CASCADE, primary_key=True, related_name='activity')
+    votings_count = models.PositiveIntegerField(default=0)
+    published_count = models.PositiveIntegerField(default=0)
+    liked_count = models.PositiveIntegerField(default=0)
+    voted_count = models.PositiveIntegerField(default=0)
+
+    @staticmethod
+    def add(counter: str, deltas: Dict[int, int]):
+        deltas = {user_id: delta for user_id, delta in deltas.items() if user_id is not None and delta}
+        if not deltas:
+            return
+        delta = Case(
+            *[When(user_id=user_id, then=Value(delta)) for user_id, delta in deltas.items()],
+            output_field=IntegerField(),
+        )
+        UserActivity.objects.filter(user_id__in=deltas.keys()).update(**{counter: F(counter) + delta})
+
+    @staticmethod
+    def rebuild(user_ids: Optional[Iterable[int]] = None) -> int:
+        users = get_user_model().objects.all()
+        if user_ids is not None:
+            users = users.filter(id__in=list(user_ids))
+        UserActivity.objects.bulk_create(
+            [UserActivity(user_id=user_id) for user_id in users.values_list('id', flat=True)],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+        return UserActivity.objects.filter(user__in=users).update(**UserActivity.get_actual_counts())
+
+    @staticmethod
+    def get_actual_counts() -> Dict:
+        user = OuterRef('user_id')
+        return {
+            'votings_count': count_rows(Voting, author=user),
+            'published_count': count_rows(Voting, author=user, published=True),
+            'liked_count': count_rows(Like, user=user, active=True),
+            'voted_count': count_rows(Participation, user=user),
+        }
+
+    @staticmethod
+    def get_for(user: get_user_model):
+        try:
+            return UserActivity.objects.get(user=user)
+        except UserActivity.DoesNotExist:
+            # Users inserted in bulk skip the post_save signal that creates their row. A replica
+            # has not seen the rebuilt row yet.
+            with primary_reads():
+                UserActivity.rebuild([user.id])
+                return UserActivity.objects.get(user=user)
 
 
 class Complaint(models.Model):
@@ -102,15 +330,54 @@ class Complaint(models.Model):
     text = models.TextField()
     is_active = models.BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['is_active'], name='complaint_active_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'voting'], condition=models.Q(is_active=True), name='unique_open_complaint'
+            ),
+        ]
+
     @staticmethod
     def get_opened_complains() -> List:
-        return Complaint.objects.filter(is_active=True).all()
+        return Complaint.objects.filter(is_active=Value(True)).all()
+
+    @staticmethod
+    def has_open_complaint(user: get_user_model, voting: Voting) -> bool:
+        return Complaint.get_opened_complains().filter(user=user, voting=voting).exists()
+
+    @staticmethod
+    def get_complaint_groups():
+        opened = Complaint.get_opened_complains().filter(voting=OuterRef('pk'))
+        return Voting.objects.filter(complaint__is_active=Value(True)).annotate(
+            open_complaints=Count('complaint'),
+            last_complaint_text=Subquery(opened.order_by('-id').values('text')[:1]),
+        ).select_related('author').order_by('-open_complaints', '-id')
+
+    @staticmethod
+    def block_votings(voting_ids: Iterable[int]) -> int:
+        voting_ids = list(voting_ids)
+        with transaction.atomic():
+            Voting.objects.filter(id__in=voting_ids).update(blocked=True)
+            closed = Complaint.get_opened_complains().filter(voting_id__in=voting_ids).update(is_active=False)
+            voting_blocked.send(sender=Complaint, voting_ids=voting_ids)
+            complaints_closed.send(sender=Complaint, voting_ids=voting_ids)
+        return closed
+
+    @staticmethod
+    def skip_votings(voting_ids: Iterable[int]) -> int:
+        voting_ids = list(voting_ids)
+        with transaction.atomic():
+            closed = Complaint.get_opened_complains().filter(voting_id__in=voting_ids).update(is_active=False)
+            complaints_closed.send(sender=Complaint, voting_ids=voting_ids)
+        return closed
 
     def block(self):
+        Complaint.block_votings([self.voting_id])
         self.is_active = False
         self.voting.blocked = True
-        self.voting.save()
-        self.save()
 
     def skip(self):
         self.is_active = False
@@ -0,0 +1,65 @@
+import base64
+import json
+from typing import List, Optional, Sequence
+from urllib.parse import urlencode
+from django.core.exceptions import ValidationError
+from django.db.models import Q, QuerySet
+from django.http import Http404
+
+
+class KeysetPage:
+    def __init__(self, queryset: QuerySet, fields: Sequence[str], cursor: Optional[str], per_page: int):
+        self._prepare(queryset, fields, cursor, per_page)
+        self._fill(list(self.queryset))
+
+    @classmethod
+    async def acreate(cls, queryset: QuerySet, fields: Sequence[str], cursor: Optional[str], per_page: int):
+        page = cls.__new__(cls)
+        page._prepare(queryset, fields, cursor, per_page)
+        page._fill([item async for item in page.queryset])
+        return page
+
+    def _prepare(self, queryset: QuerySet, fields: Sequence[str], cursor: Optional[str], per_page: int):
+        self.fields = list(fields)
+        self.per_page = per_page
+        queryset = queryset.order_by(*[f'-{field}' for field in self.fields])
+        if cursor:
+            queryset = queryset.filter(self._after(self.decode_cursor(queryset.model, cursor)))
+        self.queryset = queryset[:per_page + 1]
+
+    def _fill(self, items: List):
+        self.has_next = len(items) > self.per_page
+        self.object_list: List = items[:self.per_page]
+        self.next_cursor = self.encode_cursor(self.object_list[-1]) if self.has_next else None
+
+    @property
+    def next_query(self) -> Optional[str]:
+        return urlencode({'cursor': self.next_cursor}) if self.has_next else None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def _after(self, values: List) -> Q:
+        *fields, last = self.fields
+        condition = Q(**{f'{last}__lt': values[-1]})
+        for field, value in reversed(list(zip(fields, values))):
+            condition = Q(**{f'{field}__lte': value}) & (Q(**{f'{field}__lt': value}) | condition)
+        return condition
+
+    def encode_cursor(self, obj) -> str:
+        values = [
+            obj._meta.get_field(field).value_to_string(obj) for field in self.fields
+        ]
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def decode_cursor(self, model, cursor: str) -> List:
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if len(values) != len(self.fields):
+                raise ValueError(cursor)
+            return [model._meta.get_field(field).to_python(value) for field, value in zip(self.fields, values)]
+        except (ValueError, TypeError, ValidationError):
+            raise Http404('Invalid cursor')
@@ -0,0 +1,80 @@
+import math
+import time
+from collections import defaultdict
+from typing import Dict, Optional
+from django.conf import settings
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce, TruncHour
+
+# Feed name -> Voting field ordered on, every field has a (published, blocked, field) index.
+FEEDS = {
+    'new': 'created_at',
+    'trending': 'trending_score',
+    'liked': 'likes_count',
+    'voted': 'votes_count',
+}
+
+# Trending scores use forward decay: an event at time t adds weight * 2^(t / half life) and the
+# score keeps log2 of the sum. All scores decay by the same factor, so their order only changes
+# when an event is added and a write updates the touched votings alone. The empty score 0 stands
+# for a sum of 1 at the Unix epoch, too old to matter against any real event.
+
+
+def clock(now: Optional[float] = None) -> float:
+    return (time.time() if now is None else now) / (settings.RANKING['HALF_LIFE_HOURS'] * 60 * 60)
+
+
+def add_weight(score: float, weight: float, at: float) -> float:
+    exponent = at - score
+    if weight > 0:
+        if exponent > 0:
+            return at + math.log2(weight + 2 ** -exponent)
+        return score + math.log2(1 + weight * 2 ** exponent)
+    if exponent > 64:
+        return 0.0
+    remaining = 1 + weight * 2 ** exponent
+    if remaining <= 2 ** -score:
+        return 0.0
+    return score + math.log2(remaining)
+
+
+def add_weights(scores: Dict[int, float], weights: Dict[int, float], at: float) -> Dict[int, float]:
+    return {id: add_weight(score, weights[id], at) for id, score in scores.items() if weights.get(id)}
+
+
+def get_weight(event: str) -> float:
+    return settings.RANKING['WEIGHTS'][event]
+
+
+def get_feed_field(feed: str) -> Optional[str]:
+    return FEEDS.get(feed)
+
+
+def count_per_voting(model, **filters) -> Coalesce:
+    rows = model.objects.filter(voting=OuterRef('pk'), **filters).order_by().values('voting')
+    rows = rows.annotate(count=Count('id'))
+    return Coalesce(Subquery(rows.values('count'), output_field=IntegerField()), 0)
+
+
+def rebuild(voting_model, participation_model, like_model) -> int:
+    # Takes the models as arguments so that migrations can pass their historical versions.
+    voting_model.objects.update(
+        votes_count=count_per_voting(participation_model),
+        likes_count=count_per_voting(like_model, active=True),
+        trending_score=0,
+    )
+    scores = defaultdict(float)
+    for event, rows in (('vote', participation_model.objects.all()), ('like', like_model.objects.filter(active=True))):
+        weight = get_weight(event)
+        if not weight:
+            continue
+        hours = rows.annotate(hour=TruncHour('created_at')).order_by().values('voting_id', 'hour').annotate(
+            count=Count('id')
+        )
+        for row in hours.iterator():
+            voting_id = row['voting_id']
+            scores[voting_id] = add_weight(scores[voting_id], weight * row['count'], clock(row['hour'].timestamp()))
+    voting_model.objects.bulk_update(
+        [voting_model(id=id, trending_score=score) for id, score in scores.items()], ['trending_score'], batch_size=1000
+    )
+    return len(scores)
@@ -0,0 +1,121 @@
+import asyncio
+import functools
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+from django.utils.module_loading import import_string
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+
+def parse_rate(rate: str) -> Tuple[float, float]:
+    count, period = rate.split('/')
+    return float(count), float(count) / PERIODS[period]
+
+
+def take_token(bucket: Optional[Tuple[float, float]], capacity: float, refill_rate: float,
+               now: float) -> Tuple[Tuple[float, float], float]:
+    if bucket is None:
+        tokens = capacity
+    else:
+        tokens = min(capacity, bucket[0] + (now - bucket[1]) * refill_rate)
+    if tokens >= 1:
+        return (tokens - 1, now), 0
+    return (tokens, now), (1 - tokens) / refill_rate
+
+
+class MemoryRateLimitStore:
+    def __init__(self, max_keys: int = 100000):
+        self.buckets = OrderedDict()
+        self.max_keys = max_keys
+        self.lock = threading.Lock()
+
+    def hit(self, key: str, capacity: float, refill_rate: float) -> float:
+        with self.lock:
+            bucket, wait = take_token(self.buckets.pop(key, None), capacity, refill_rate, time.monotonic())
+            self.buckets[key] = bucket
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        return wait
+
+
+class CacheRateLimitStore:
+    # Shares buckets between processes through the 'ratelimit' cache. The read and
+    # write are not atomic, so concurrent hits on one key may both pass.
+
+    def __init__(self):
+        self.cache = caches['ratelimit']
+
+    def hit(self, key: str, capacity: float, refill_rate: float) -> float:
+        bucket, wait = take_token(self.cache.get(key), capacity, refill_rate, time.time())
+        self.cache.set(key, bucket, math.ceil(capacity / refill_rate))
+        return wait
+
+
+_store = None
+_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    with _lock:
+        if _store is None:
+            _store = import_string(settings.RATE_LIMIT_STORE)()
+        return _store
+
+
+def get_limits(scope: str) -> Dict[str, Tuple[float, float]]:
+    if not settings.RATE_LIMIT_ENABLED:
+        return {}
+    return {kind: parse_rate(rate) for kind, rate in settings.RATE_LIMITS.get(scope, {}).items()}
+
+
+def get_client_ip(request) -> str:
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def get_user_id(request) -> Optional[int]:
+    return request.user.id if request.user.is_authenticated else None
+
+
+def limited_response(wait: float) -> JsonResponse:
+    response = JsonResponse({'message': 'Too many requests'}, status=429)
+    response['Retry-After'] = str(math.ceil(wait))
+    return response
+
+
+def check_limits(scope: str, request) -> Optional[JsonResponse]:
+    # The IP bucket goes first: it is checked without touching the session or the database.
+    limits = get_limits(scope)
+    for kind in ('ip', 'user'):
+        if kind not in limits:
+            continue
+        key = get_client_ip(request) if kind == 'ip' else get_user_id(request)
+        if key is None:
+            continue
+        wait = get_store().hit(f'ratelimit:{scope}:{kind}:{key}', *limits[kind])
+        if wait:
+            logging.info('Rate limit %s hit by %s %s.', scope, kind, key)
+            return limited_response(wait)
+    return None
+
+
+def rate_limit(scope: str):
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                return await sync_to_async(check_limits)(scope, request) or await view(request, *args, **kwargs)
+        else:
+            @functools.wraps(view)
+            def wrapper(request, *args, **kwargs):
+                return check_limits(scope, request) or view(request, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,36 @@
+from typing import List, Set, Tuple
+from django.contrib.auth import get_user_model
+from main.cache import get_or_compute_results
+from main.db import primary_reads
+from main.models import Voting, Question, VoteFact
+
+
+def get_results(voting: Voting) -> List[Question]:
+    questions = list(voting.question_set.order_by('id').prefetch_related('variant_set'))
+    for question in questions:
+        for variant in question.variant_set.all():
+            variant.percent = (
+                int(variant.votes_count / question.votes_count * 100) if question.votes_count != 0 else 0
+            )
+    return questions
+
+
+def get_cached_results(voting: Voting) -> Tuple[int, List[Question]]:
+    def compute():
+        # Cached under the current version, so a lagging replica must not provide it.
+        with primary_reads():
+            return get_results(voting)
+
+    return get_or_compute_results(voting.id, compute)
+
+
+def _voted_variant_ids(voting: Voting, user: get_user_model):
+    return VoteFact.objects.filter(user=user, variant__question__voting=voting).values_list('variant_id', flat=True)
+
+
+def get_voted_variant_ids(voting: Voting, user: get_user_model) -> Set[int]:
+    return set(_voted_variant_ids(voting, user))
+
+
+async def aget_voted_variant_ids(voting: Voting, user: get_user_model) -> Set[int]:
+    return {variant_id async for variant_id in _voted_variant_ids(voting, user)}
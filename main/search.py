@@ -0,0 +1,153 @@
+import re
+from typing import List, Optional
+from urllib.parse import urlencode
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q, QuerySet
+from django.utils.module_loading import import_string
+
+
+class BasicSearchBackend:
+    def index_voting(self, voting_id: int):
+        pass
+
+    def remove_voting(self, voting_id: int):
+        pass
+
+    def index_complaint(self, complaint_id: int):
+        pass
+
+    def remove_complaint(self, complaint_id: int):
+        pass
+
+    def remove_voting_complaints(self, voting_ids: List[int]):
+        pass
+
+    def search_votings(self, query: str, limit: int, offset: int) -> List[int]:
+        from main.models import Question, Voting
+
+        questions = Question.objects.filter(Q(title__icontains=query) | Q(description__icontains=query))
+        votings = Voting.get_active_votings().filter(
+            Q(title__icontains=query) | Q(id__in=questions.values('voting_id'))
+        )
+        return list(votings.order_by('-created_at').values_list('id', flat=True)[offset:offset + limit])
+
+    def search_complaints(self, query: str, limit: int, offset: int) -> List[int]:
+        from main.models import Complaint
+
+        complaints = Complaint.get_opened_complains().filter(text__icontains=query)
+        return list(complaints.order_by('-id').values_list('id', flat=True)[offset:offset + limit])
+
+
+class SQLiteFTSBackend:
+    # main_voting_fts holds active votings only, main_complaint_fts open complaints only,
+    # both keyed by rowid = id of the row they index. Created by migration 0010.
+
+    def index_voting(self, voting_id: int):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                '''
+                INSERT OR REPLACE INTO main_voting_fts (rowid, title, questions)
+                SELECT v.id, v.title, coalesce(group_concat(q.title || ' ' || q.description, ' '), '')
+                FROM main_voting v LEFT JOIN main_question q ON q.voting_id = v.id
+                WHERE v.id = %s AND v.published = 1 AND v.blocked = 0
+                GROUP BY v.id
+                ''',
+                [voting_id],
+            )
+            if cursor.rowcount == 0:
+                cursor.execute('DELETE FROM main_voting_fts WHERE rowid = %s', [voting_id])
+
+    def remove_voting(self, voting_id: int):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM main_voting_fts WHERE rowid = %s', [voting_id])
+
+    def index_complaint(self, complaint_id: int):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                '''
+                INSERT OR REPLACE INTO main_complaint_fts (rowid, text)
+                SELECT id, text FROM main_complaint WHERE id = %s AND is_active = 1
+                ''',
+                [complaint_id],
+            )
+            if cursor.rowcount == 0:
+                cursor.execute('DELETE FROM main_complaint_fts WHERE rowid = %s', [complaint_id])
+
+    def remove_complaint(self, complaint_id: int):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM main_complaint_fts WHERE rowid = %s', [complaint_id])
+
+    def remove_voting_complaints(self, voting_ids: List[int]):
+        if not voting_ids:
+            return
+        placeholders = ', '.join(['%s'] * len(voting_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'DELETE FROM main_complaint_fts WHERE rowid IN '
+                f'(SELECT id FROM main_complaint WHERE voting_id IN ({placeholders}))',
+                voting_ids,
+            )
+
+    def search_votings(self, query: str, limit: int, offset: int) -> List[int]:
+        # Title matches weigh more than matches in question texts.
+        return self._search(
+            'SELECT rowid FROM main_voting_fts WHERE main_voting_fts MATCH %s '
+            'ORDER BY bm25(main_voting_fts, 10.0, 1.0) LIMIT %s OFFSET %s',
+            query, limit, offset,
+        )
+
+    def search_complaints(self, query: str, limit: int, offset: int) -> List[int]:
+        return self._search(
+            'SELECT rowid FROM main_complaint_fts WHERE main_complaint_fts MATCH %s '
+            'ORDER BY rank LIMIT %s OFFSET %s',
+            query, limit, offset,
+        )
+
+    def _search(self, sql: str, query: str, limit: int, offset: int) -> List[int]:
+        match = self.to_match(query)
+        if not match:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [match, limit, offset])
+            return [row[0] for row in cursor.fetchall()]
+
+    @staticmethod
+    def to_match(query: str) -> str:
+        # Every word is quoted so user input never reaches FTS5 query syntax, the last one
+        # is matched as a prefix for search-as-you-type.
+        words = re.findall(r'\w+', query)
+        return ' '.join(f'"{word}"' for word in words) + ('*' if words else '')
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = import_string(settings.SEARCH_BACKEND)()
+    return _backend
+
+
+class SearchPage:
+    def __init__(self, search, queryset: QuerySet, query: str, page: Optional[str], per_page: int):
+        try:
+            self.number = max(1, int(page or 1))
+        except ValueError:
+            self.number = 1
+        self.query = query
+        ids = search(query, per_page + 1, (self.number - 1) * per_page)
+        self.has_next = len(ids) > per_page
+        objects = queryset.in_bulk(ids[:per_page])
+        self.object_list = [objects[id] for id in ids[:per_page] if id in objects]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def next_query(self) -> Optional[str]:
+        return urlencode({'q': self.query, 'page': self.number + 1}) if self.has_next else None
@@ -0,0 +1,138 @@
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import Signal, receiver
+from main import search
+from main.cache import bump_fragment_version, bump_results_version
+from main.streaming import hub
+
+votes_cast = Signal()
+voting_liked = Signal()
+voting_blocked = Signal()
+complaints_closed = Signal()
+
+
+def _bump_on_commit(voting_ids):
+    def bump():
+        for voting_id in voting_ids:
+            bump_results_version(voting_id)
+            bump_fragment_version(voting_id)
+
+    transaction.on_commit(bump)
+
+
+def _bump_fragments_on_commit(voting_ids):
+    def bump():
+        for voting_id in voting_ids:
+            bump_fragment_version(voting_id)
+
+    transaction.on_commit(bump)
+
+
+@receiver(votes_cast)
+def bump_voted_votings(sender, votes, **kwargs):
+    _bump_on_commit(set(votes))
+
+
+@receiver(votes_cast)
+def stream_votes(sender, votes, **kwargs):
+    def publish():
+        for voting_id, deltas in votes.items():
+            hub.publish(voting_id, deltas)
+
+    transaction.on_commit(publish)
+
+
+@receiver(voting_liked)
+def bump_liked_votings(sender, voting_ids, **kwargs):
+    _bump_fragments_on_commit(set(voting_ids))
+
+
+@receiver(voting_blocked)
+def bump_blocked_votings(sender, voting_ids, **kwargs):
+    _bump_on_commit(set(voting_ids))
+
+
+@receiver(voting_blocked)
+def unindex_blocked_votings(sender, voting_ids, **kwargs):
+    for voting_id in voting_ids:
+        search.get_backend().remove_voting(voting_id)
+
+
+@receiver(complaints_closed)
+def unindex_closed_complaints(sender, voting_ids, **kwargs):
+    search.get_backend().remove_voting_complaints(voting_ids)
+
+
+@receiver(post_save, sender='main.Question')
+@receiver(post_delete, sender='main.Question')
+def bump_question_voting(sender, instance, **kwargs):
+    _bump_on_commit({instance.voting_id})
+    search.get_backend().index_voting(instance.voting_id)
+
+
+@receiver(post_save, sender='main.Voting')
+def index_voting(sender, instance, **kwargs):
+    search.get_backend().index_voting(instance.id)
+
+
+@receiver(post_save, sender='main.Voting')
+def bump_saved_voting(sender, instance, **kwargs):
+    _bump_fragments_on_commit({instance.id})
+
+
+@receiver(post_delete, sender='main.Voting')
+def unindex_voting(sender, instance, **kwargs):
+    search.get_backend().remove_voting(instance.id)
+
+
+@receiver(post_save, sender='main.Complaint')
+def index_complaint(sender, instance, **kwargs):
+    search.get_backend().index_complaint(instance.id)
+
+
+@receiver(post_delete, sender='main.Complaint')
+def unindex_complaint(sender, instance, **kwargs):
+    search.get_backend().remove_complaint(instance.id)
+
+
+@receiver(post_save, sender='main.Variant')
+@receiver(post_delete, sender='main.Variant')
+def bump_variant_voting(sender, instance, **kwargs):
+    questions = apps.get_model('main', 'Question').objects.filter(id=instance.question_id)
+    _bump_on_commit(set(questions.values_list('voting_id', flat=True)))
+
+
+def _activity():
+    # main.models imports this module, so the model is looked up when the signal fires.
+    return apps.get_model('main', 'UserActivity')
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def create_user_activity(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        _activity().objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender='main.Voting')
+def count_created_voting(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        _activity().add('votings_count', {instance.author_id: 1})
+        if instance.published:
+            _activity().add('published_count', {instance.author_id: 1})
+
+
+@receiver(pre_delete, sender='main.Voting')
+def uncount_deleted_voting(sender, instance, **kwargs):
+    UserActivity = _activity()
+    UserActivity.add('votings_count', {instance.author_id: -1})
+    if instance.published:
+        UserActivity.add('published_count', {instance.author_id: -1})
+    for counter, rows in (
+            ('voted_count', instance.participation_set.all()),
+            ('liked_count', instance.like_set.filter(active=True)),
+    ):
+        user_ids = list(rows.values_list('user_id', flat=True))
+        for i in range(0, len(user_ids), 500):
+            UserActivity.add(counter, {user_id: -1 for user_id in user_ids[i:i + 500]})
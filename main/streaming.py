@@ -0,0 +1,102 @@
+import asyncio
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+from django.conf import settings
+
+
+class Subscription:
+    def __init__(self):
+        self.deltas = Counter()
+        self.changed = asyncio.Event()
+        self.after = 0
+
+    def push(self, sequence: int, deltas: Dict[int, int]):
+        if sequence > self.after:
+            self.deltas.update(deltas)
+            self.changed.set()
+
+    async def next(self, timeout: float) -> Optional[Dict[int, int]]:
+        try:
+            await asyncio.wait_for(self.changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        deltas, self.deltas = self.deltas, Counter()
+        self.changed.clear()
+        return dict(deltas)
+
+
+class VotingChannel:
+    def __init__(self, voting_id: int):
+        self.voting_id = voting_id
+        self.pending: List[Tuple[int, Dict[int, int]]] = []
+        self.changed = asyncio.Event()
+        self.subscriptions = set()
+        self.loop = asyncio.get_running_loop()
+        self.task = self.loop.create_task(self.run())
+
+    def add(self, sequence: int, deltas: Dict[int, int]):
+        self.pending.append((sequence, deltas))
+        self.changed.set()
+
+    async def run(self):
+        interval = 1 / settings.RESULTS_STREAM_MAX_TICKS_PER_SECOND
+        while self.subscriptions:
+            await self.changed.wait()
+            self.changed.clear()
+            pending, self.pending = self.pending, []
+            for subscription in self.subscriptions:
+                for sequence, deltas in pending:
+                    subscription.push(sequence, deltas)
+            await asyncio.sleep(interval)
+
+
+class ResultsHub:
+    # Deltas are numbered as they are published, after their commit. A subscriber drops the
+    # ones published before it read its snapshot, those are already counted in it. Publishing
+    # happens after the commit of a vote and must never fail it.
+    def __init__(self):
+        self.channels: Dict[int, VotingChannel] = {}
+        self.lock = threading.Lock()
+        self.sequence = 0
+
+    def publish(self, voting_id: int, deltas: Dict[int, int]):
+        with self.lock:
+            self.sequence += 1
+            sequence = self.sequence
+            channel = self.channels.get(voting_id)
+            if channel is None:
+                return
+        try:
+            channel.loop.call_soon_threadsafe(channel.add, sequence, deltas)
+        except RuntimeError:
+            # The event loop of the channel is closed, its subscribers are gone with it.
+            with self.lock:
+                if self.channels.get(voting_id) is channel:
+                    del self.channels[voting_id]
+
+    def subscribe(self, voting_id: int) -> Subscription:
+        subscription = Subscription()
+        with self.lock:
+            channel = self.channels.get(voting_id)
+            if channel is None or channel.loop.is_closed():
+                channel = self.channels[voting_id] = VotingChannel(voting_id)
+            channel.subscriptions.add(subscription)
+        return subscription
+
+    def skip_published(self, subscription: Subscription):
+        with self.lock:
+            subscription.after = self.sequence
+
+    def unsubscribe(self, voting_id: int, subscription: Subscription):
+        with self.lock:
+            channel = self.channels.get(voting_id)
+            if channel is None:
+                return
+            channel.subscriptions.discard(subscription)
+            if not channel.subscriptions:
+                del self.channels[voting_id]
+                channel.changed.set()
+
+
+hub = ResultsHub()
@@ -1,3 +1,1079 @@
-from django.test import TestCase
+import asyncio
+import importlib
+import json
+import os
+import re
+import time
+from collections import Counter
+from io import StringIO
+from typing import Dict, List
+from unittest import mock, skipUnless
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth import get_user_model
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.utils import make_template_fragment_key
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.http import HttpResponse
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import clear_url_caches, resolve, reverse
+from main import async_views, ingestion, metrics, ranking, ratelimit, search, streaming, views
+from main.cache import bump_results_version, get_or_compute_results, get_results_version
+from main.db import ReplicaRouter, primary_reads, replica_reads
+from main.middleware import ReplicaMiddleware
+from main.models import Voting, Question, Variant, VoteFact, Like, Complaint, Participation, UserActivity
 
-# Create your tests here.
+
+def query_plan(queryset) -> List[str]:
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return [row[3] for row in cursor.fetchall()]
+
+
+@skipUnless(connection.vendor == 'sqlite', 'SQLite profile only')
+class SQLiteProfileTests(TestCase):
+    def pragma(self, name: str):
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_pragmas(self):
+        self.assertEqual(self.pragma('synchronous'), 1)
+        self.assertEqual(self.pragma('busy_timeout'), settings.SQLITE_PRAGMAS['busy_timeout'])
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN is SQLite specific')
+class HotQueryPlanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('voter', password='password')
+        cls.voting = Voting.objects.create(title='Voting', author=cls.user, published=True)
+        cls.question = Question.objects.create(title='Question', description='', voting=cls.voting, type=1)
+        cls.variant = Variant.objects.create(text='Variant', question=cls.question)
+
+    def assertNoFullScan(self, queryset):
+        plan = query_plan(queryset)
+        scans = [step for step in plan if re.match(r'SCAN ', step)]
+        self.assertEqual(scans, [], f'Full scan in query plan: {plan}')
+
+    def test_is_user_voted(self):
+        self.assertNoFullScan(Participation.objects.filter(user=self.user, voting=self.voting))
+
+    def test_voted_votings(self):
+        self.assertNoFullScan(Voting.get_voted_votings(self.user))
+
+    def test_voted_variants(self):
+        self.assertNoFullScan(
+            VoteFact.objects.filter(user=self.user, variant__question__voting=self.voting).values('variant_id')
+        )
+
+    def test_is_user_liked(self):
+        self.assertNoFullScan(Like.objects.filter(user=self.user, voting=self.voting, active=True))
+
+    def test_liked_votings(self):
+        self.assertNoFullScan(Voting.get_liked_votings(self.user))
+
+    def test_active_votings_feed(self):
+        self.assertNoFullScan(Voting.get_active_votings().order_by('-created_at', '-id')[:21])
+
+    def test_votings_of_user(self):
+        self.assertNoFullScan(Voting.get_votings_of_user(self.user))
+
+    def test_profile_sections(self):
+        for queryset, field in (
+                (Voting.get_votings_of_user(self.user), 'id'),
+                (Like.get_liked_by(self.user), 'voting_id'),
+                (Participation.get_voted_by(self.user), 'voting_id'),
+        ):
+            page = queryset.order_by(f'-{field}').filter(**{f'{field}__lt': 100})[:21]
+            self.assertNoFullScan(page)
+            plan = query_plan(page)
+            self.assertFalse([step for step in plan if 'TEMP B-TREE' in step], f'Sort in query plan: {plan}')
+
+    def test_ranked_feeds(self):
+        for field in ranking.FEEDS.values():
+            feed = Voting.get_active_votings().order_by(f'-{field}', '-id')[:21]
+            self.assertNoFullScan(feed)
+            plan = query_plan(feed)
+            self.assertFalse([step for step in plan if 'TEMP B-TREE' in step], f'Sort in query plan: {plan}')
+
+    def test_card_overlay(self):
+        ids = [self.voting.id]
+        liked = Like.objects.filter(user=self.user, voting_id__in=ids, active=True).values_list('voting_id', flat=True)
+        voted = Participation.objects.filter(user=self.user, voting_id__in=ids).values_list('voting_id', flat=True)
+        self.assertNoFullScan(liked.union(voted, all=True))
+
+    def test_opened_complains(self):
+        self.assertNoFullScan(
+            Complaint.get_opened_complains().select_related('user', 'voting').order_by('-id')[:21]
+        )
+
+    def test_voting_tree(self):
+        self.assertNoFullScan(self.voting.question_set.all())
+        self.assertNoFullScan(Variant.objects.filter(question__in=[self.question]))
+
+
+def seed_votes(votes: int, questions: int = 100, variants: int = 10) -> Dict:
+    # One big voting of questions x variants, every voter picks one variant in each of
+    # ten questions until the votes run out. Every voter authors a voting of their own, likes
+    # and complains about the big one.
+    User = get_user_model()
+    viewer = User.objects.create_user('viewer', password='password', is_staff=True)
+    voters = User.objects.bulk_create(
+        [User(username=f'voter{i}') for i in range(max(25, votes // 10))], batch_size=1000
+    )
+    voting = Voting.objects.create(title='Big voting', author=viewer, published=True)
+    question_list = Question.objects.bulk_create(
+        [Question(title=f'Question {i}', description='', voting=voting, type=2) for i in range(questions)]
+    )
+    variant_list = Variant.objects.bulk_create(
+        [Variant(text=f'Variant {j}', question=question) for question in question_list for j in range(variants)],
+        batch_size=1000,
+    )
+    Voting.objects.bulk_create(
+        [Voting(title=f'Voting {i}', author=voter, published=True) for i, voter in enumerate(voters)], batch_size=1000
+    )
+    draft = Voting.objects.create(title='Draft', author=viewer)
+    draft_question = Question.objects.create(title='Draft question', description='', voting=draft, type=1)
+    Variant.objects.create(text='Draft variant', question=draft_question)
+    facts = []
+    for i, voter in enumerate([viewer] + voters):
+        for k in range(10):
+            facts.append(VoteFact(user=voter, variant=variant_list[((i + k) % questions) * variants + i % variants]))
+            if len(facts) == votes:
+                break
+        if len(facts) == votes:
+            break
+    VoteFact.objects.bulk_create(facts, batch_size=1000)
+    participants = Participation.objects.bulk_create(
+        [Participation(user_id=user_id, voting=voting) for user_id in {fact.user.id for fact in facts}],
+        batch_size=1000,
+    )
+    counts = Counter(fact.variant.id for fact in facts)
+    for variant in variant_list:
+        variant.votes_count = counts[variant.id]
+    Variant.objects.bulk_update(variant_list, ['votes_count'], batch_size=1000)
+    counts = Counter(fact.variant.question_id for fact in facts)
+    for question in question_list:
+        question.votes_count = counts[question.id]
+    Question.objects.bulk_update(question_list, ['votes_count'], batch_size=1000)
+    Like.objects.bulk_create([Like(user=voter, voting=voting) for voter in [viewer] + voters], batch_size=1000)
+    Voting.objects.filter(id=voting.id).update(likes_count=len(voters) + 1, votes_count=len(participants))
+    Complaint.objects.bulk_create(
+        [Complaint(user=voter, voting=voting, text=f'Complaint {i}') for i, voter in enumerate(voters)],
+        batch_size=1000,
+    )
+    UserActivity.rebuild()
+    return {
+        'viewer': viewer,
+        'voting': voting,
+        'question': question_list[0],
+        'draft': draft,
+        'draft_question': draft_question,
+        'complaint': Complaint.objects.filter(voting=voting).first(),
+    }
+
+
+@override_settings(RATE_LIMIT_ENABLED=False)
+class QueryBudgetTests(TestCase):
+    # Query count of every page must stay within its budget and must not grow with data size.
+    # The 100k votes size takes a while to seed, set QUERY_BUDGET_LARGE=1 to include it.
+    # Timings are written as JSON to the file named by QUERY_BUDGET_REPORT, if set.
+    SIZES = [10, 1000] + ([100000] if os.environ.get('QUERY_BUDGET_LARGE') == '1' else [])
+
+    @staticmethod
+    def get_requests(data: Dict) -> Dict:
+        voting, draft = data['voting'], data['draft']
+        return {
+            'index': ('get', reverse('index'), {}, 2),
+            'login': ('get', reverse('login'), {}, 2),
+            'signup': ('get', reverse('signup'), {}, 2),
+            'metrics': ('get', reverse('metrics'), {}, 0),
+            'list_votings': ('get', reverse('list_votings'), {}, 4),
+            'list_votings_cursor': ('get', reverse('list_votings'), {'cursor': 'cursor'}, 4),
+            'list_votings_search': ('get', reverse('list_votings'), {'q': 'Voting'}, 5),
+            'list_votings_json': ('get', reverse('list_votings_json'), {}, 3),
+            'list_votings_trending': ('get', reverse('list_votings'), {'sort': 'trending'}, 4),
+            'create_voting': ('get', reverse('create_voting'), {}, 2),
+            'create_questions': ('get', reverse('create_questions', kwargs={'id': draft.id}), {}, 4),
+            'create_variants': ('get', reverse('create_variants', kwargs={'id': data['draft_question'].id}), {}, 5),
+            'voting': ('get', reverse('voting', kwargs={'id': voting.id}), {}, 7),
+            'question': ('get', reverse('question', kwargs={'id': data['draft_question'].id}), {}, 6),
+            'like': ('post', reverse('like', kwargs={'id': voting.id}), {}, 9),
+            'likes_state': ('get', reverse('likes_state'), {'ids': f'{voting.id},{draft.id}'}, 4),
+            'profile': ('get', reverse('profile', kwargs={'id': data['viewer'].id}), {}, 4),
+            **{
+                f'profile_{section}': (
+                    'get', reverse('profile_section', kwargs={'id': data['viewer'].id, 'section': section}), {}, 5
+                )
+                for section in ('votings', 'liked', 'voted')
+            },
+            'password_change': ('get', reverse('password_change'), {}, 2),
+            'reset_password': ('get', reverse('reset_password'), {}, 2),
+            'complains_list': ('get', reverse('complains_list'), {}, 3),
+            'complains_list_search': ('get', reverse('complains_list'), {'q': 'Complaint'}, 3),
+            'moderation': ('get', reverse('moderation'), {}, 4),
+            'complaint': ('get', reverse('complaint', kwargs={'id': data['complaint'].id}), {}, 4),
+            'create_complaint': ('get', reverse('create_complaint', kwargs={'id': voting.id}), {}, 3),
+            'publish_voting': ('get', reverse('publish_voting', kwargs={'id': draft.id}), {}, 9),
+        }
+
+    def measure(self, votes: int) -> Dict:
+        savepoint = transaction.savepoint()
+        data = seed_votes(votes)
+        call_command('rebuild_tallies', '--verify', stdout=StringIO())
+        self.client.force_login(data['viewer'])
+        results = {}
+        for name, (method, url, params, budget) in self.get_requests(data).items():
+            if params.get('cursor'):
+                params = dict(params, cursor=self.client.get(reverse('list_votings_json')).json()['next_cursor'])
+            caches['results'].clear()
+            start = time.perf_counter()
+            with CaptureQueriesContext(connection) as queries:
+                response = getattr(self.client, method)(url, params)
+            elapsed = time.perf_counter() - start
+            self.assertLess(response.status_code, 400, f'{name} answered {response.status_code}')
+            results[name] = {'queries': len(queries), 'budget': budget, 'seconds': elapsed}
+        transaction.savepoint_rollback(savepoint)
+        caches['results'].clear()
+        return results
+
+    def test_query_budgets(self):
+        measured = {votes: self.measure(votes) for votes in self.SIZES}
+        smallest = measured[self.SIZES[0]]
+        for votes, results in measured.items():
+            for name, result in results.items():
+                with self.subTest(view=name, votes=votes):
+                    self.assertLessEqual(result['queries'], result['budget'])
+                    self.assertEqual(result['queries'], smallest[name]['queries'], 'Query count grows with data')
+        report = os.environ.get('QUERY_BUDGET_REPORT')
+        if report:
+            with open(report, 'w') as file:
+                json.dump(measured, file, indent=2)
+
+
+class UserActivityTests(TestCase):
+    def counts(self, user) -> Dict:
+        activity = UserActivity.objects.get(user=user)
+        return {counter: getattr(activity, counter) for counter in UserActivity.get_actual_counts()}
+
+    def test_counters_follow_writes(self):
+        author = get_user_model().objects.create_user('author', password='password')
+        voter = get_user_model().objects.create_user('voter', password='password')
+        voting = Voting.objects.create(title='Voting', author=author)
+        question = Question.objects.create(title='Question', description='', voting=voting, type=1)
+        variant = Variant.objects.create(text='Variant', question=question)
+        voting.publish()
+        voting.publish()
+        voting.vote(voter, [variant.id])
+        voting.like(voter)
+        voting.like(author)
+        voting.like(author)
+        self.assertEqual(
+            self.counts(author), {'votings_count': 1, 'published_count': 1, 'liked_count': 0, 'voted_count': 0}
+        )
+        self.assertEqual(
+            self.counts(voter), {'votings_count': 0, 'published_count': 0, 'liked_count': 1, 'voted_count': 1}
+        )
+        incremental = [self.counts(author), self.counts(voter)]
+        UserActivity.rebuild()
+        self.assertEqual([self.counts(author), self.counts(voter)], incremental)
+        voting.delete()
+        self.assertEqual(set(self.counts(author).values()) | set(self.counts(voter).values()), {0})
+
+    def test_sections_are_paged(self):
+        user = get_user_model().objects.create_user('author', password='password')
+        other = get_user_model().objects.create_user('other', password='password')
+        Voting.objects.bulk_create([Voting(title=f'Voting {i}', author=user) for i in range(25)])
+        self.client.force_login(user)
+        url = reverse('profile_section', kwargs={'id': user.id, 'section': 'votings'})
+        first = self.client.get(url)
+        self.assertEqual(len(first.context['votings']), 20)
+        second = self.client.get(first.context['next_url'])
+        self.assertEqual(len(second.context['votings']), 5)
+        self.assertIsNone(second.context['next_url'])
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(
+            self.client.get(reverse('profile_section', kwargs={'id': user.id, 'section': 'liked'})).status_code, 403
+        )
+        self.assertEqual(
+            self.client.get(reverse('profile_section', kwargs={'id': user.id, 'section': 'other'})).status_code, 404
+        )
+
+    @override_settings(DATABASE_REPLICA_ALIASES=['default'])
+    def test_missing_row_is_read_from_primary(self):
+        get_user_model().objects.bulk_create([get_user_model()(username='bulk', password='password')])
+        user = get_user_model().objects.get(username='bulk')
+        token = replica_reads.set(True)
+        try:
+            with mock.patch('main.db.random.choice', return_value='default') as choice:
+                self.assertEqual(UserActivity.get_for(user).user_id, user.id)
+            choice.assert_called_once()
+        finally:
+            replica_reads.reset(token)
+
+
+@override_settings(RANKING={'HALF_LIFE_HOURS': 24, 'WEIGHTS': {'vote': 1.0, 'like': 0.5}})
+class RankingTests(TestCase):
+    def test_decay(self):
+        day = ranking.clock(24 * 60 * 60)
+        older = ranking.add_weight(ranking.add_weight(0, 1, 10 * day), 1, 10 * day)
+        newer = ranking.add_weight(0, 1, 11 * day)
+        self.assertAlmostEqual(older, newer)
+        self.assertGreater(ranking.add_weight(newer, 1, 10 * day), newer)
+        self.assertEqual(ranking.add_weight(newer, -1, 11 * day), 0)
+
+    def test_feeds_follow_writes(self):
+        author = get_user_model().objects.create_user('author', password='password')
+        voters = [get_user_model().objects.create_user(f'voter{i}', password='password') for i in range(3)]
+        votings = [Voting.objects.create(title=f'Voting {i}', author=author, published=True) for i in range(3)]
+        questions = [
+            Question.objects.create(title='Question', description='', voting=voting, type=1) for voting in votings
+        ]
+        variants = [Variant.objects.create(text='Variant', question=question) for question in questions]
+        for voter in voters:
+            votings[1].vote(voter, [variants[1].id])
+        votings[0].vote(voters[0], [variants[0].id])
+        for voter in voters[:2]:
+            votings[2].like(voter)
+        votings[2].like(voters[2])
+        votings[2].like(voters[2])
+        self.client.force_login(author)
+
+        def feed(sort: str) -> List[str]:
+            response = self.client.get(reverse('list_votings'), {'sort': sort})
+            return [voting.title for voting in response.context['votings']]
+
+        self.assertEqual(feed('voted'), ['Voting 1', 'Voting 0', 'Voting 2'])
+        self.assertEqual(feed('liked'), ['Voting 2', 'Voting 1', 'Voting 0'])
+        self.assertEqual(feed('trending'), ['Voting 1', 'Voting 2', 'Voting 0'])
+        incremental = list(Voting.objects.order_by('id').values_list('votes_count', 'likes_count'))
+        ranking.rebuild(Voting, Participation, Like)
+        self.assertEqual(list(Voting.objects.order_by('id').values_list('votes_count', 'likes_count')), incremental)
+        self.assertEqual(feed('trending'), ['Voting 1', 'Voting 2', 'Voting 0'])
+        self.assertEqual(self.client.get(reverse('list_votings'), {'sort': 'random'}).status_code, 404)
+
+    def test_unlike_takes_back_its_like(self):
+        author = get_user_model().objects.create_user('author', password='password')
+        reader = get_user_model().objects.create_user('reader', password='password')
+        voting = Voting.objects.create(title='Voting', author=author, published=True)
+        voting.like(author)
+        voting.refresh_from_db()
+        score = voting.trending_score
+        voting.like(reader)
+        liked_at = Like.objects.get(user=reader).created_at
+        # Two days later the like weighs 4 times more on the current clock, the unlike still takes back its own.
+        with mock.patch('main.ranking.time.time', return_value=time.time() + 48 * 60 * 60):
+            self.assertFalse(voting.like(reader))
+        voting.refresh_from_db()
+        self.assertAlmostEqual(voting.trending_score, score)
+        self.assertTrue(voting.like(reader))
+        self.assertGreater(Like.objects.get(user=reader).created_at, liked_at)
+        voting.like(reader)
+        voting.refresh_from_db()
+        self.assertAlmostEqual(voting.trending_score, score)
+
+
+class PublishTests(TestCase):
+    def test_publish_keeps_concurrent_like(self):
+        author = get_user_model().objects.create_user('author', password='password')
+        reader = get_user_model().objects.create_user('reader', password='password')
+        voting = Voting.objects.create(title='Voting', author=author)
+        loaded = Voting.objects.get(id=voting.id)
+        voting.like(reader)
+        loaded.publish()
+        voting.refresh_from_db()
+        self.assertTrue(voting.published)
+        self.assertEqual(voting.likes_count, 1)
+        self.assertGreater(voting.trending_score, 0)
+
+
+class IngestionTests(TestCase):
+    def setUp(self):
+        author = get_user_model().objects.create_user('author', password='password')
+        self.voters = [get_user_model().objects.create_user(f'voter{i}', password='password') for i in range(3)]
+        self.voting = Voting.objects.create(title='Voting', author=author, published=True)
+        question = Question.objects.create(title='Question', description='', voting=self.voting, type=1)
+        self.variant = Variant.objects.create(text='Variant', question=question)
+
+    def flush(self, voters) -> int:
+        vote_queue = ingestion.LocalVoteQueue(10)
+        for voter in voters:
+            ballot = {'user_id': voter.id, 'voting_id': self.voting.id, 'variant_ids': [self.variant.id]}
+            caches['pending_votes'].set(ingestion.pending_key(voter.id, self.voting.id), ballot['variant_ids'])
+            vote_queue.put(ballot, 0)
+        ingestion.VoteWriter(vote_queue, 10, 0).flush()
+        return Participation.objects.filter(voting=self.voting).count()
+
+    def assert_written(self, participants: int):
+        self.voting.refresh_from_db()
+        self.variant.refresh_from_db()
+        self.assertEqual(self.voting.votes_count, participants)
+        self.assertEqual(self.variant.votes_count, participants)
+        self.assertEqual(VoteFact.objects.filter(variant=self.variant).count(), participants)
+        for voter in self.voters:
+            self.assertEqual(ingestion.get_pending_variant_ids(self.voting, voter), set())
+
+    def test_duplicate_in_batch_rejects_only_duplicate(self):
+        self.voting.vote(self.voters[0], [self.variant.id])
+        # Another process wrote the participation after the batch checked for it.
+        with mock.patch.object(ingestion, 'get_existing_pairs', return_value=set()):
+            self.assertEqual(self.flush(self.voters), 3)
+        self.assert_written(3)
+
+    def test_crash_mid_batch_rejects_only_failing_ballot(self):
+        add_votes = VoteFact.add_votes
+
+        def failing_add_votes(vote_facts):
+            if any(fact.user_id == self.voters[1].id for fact in vote_facts):
+                raise RuntimeError('Crash')
+            add_votes(vote_facts)
+
+        with mock.patch.object(VoteFact, 'add_votes', side_effect=failing_add_votes):
+            self.assertEqual(self.flush(self.voters), 2)
+        self.assertFalse(self.voting.is_user_voted(self.voters[1]))
+        self.assert_written(2)
+
+    def test_pending_cleared_after_write(self):
+        self.assertEqual(self.flush(self.voters[:2]), 2)
+        self.assert_written(2)
+
+
+class ResultsCacheTests(TestCase):
+    def setUp(self):
+        caches['results'].clear()
+        author = get_user_model().objects.create_user('author', password='password')
+        self.voting = Voting.objects.create(title='Voting', author=author, published=True)
+        self.question = Question.objects.create(title='Question', description='', voting=self.voting, type=1)
+        self.variant = Variant.objects.create(text='Variant', question=self.question)
+
+    def test_version_bump(self):
+        version = get_results_version(self.voting.id)
+        self.assertEqual(get_results_version(self.voting.id), version)
+        bump_results_version(self.voting.id)
+        self.assertEqual(get_results_version(self.voting.id), version + 1)
+        caches['results'].clear()
+        self.assertGreater(get_results_version(self.voting.id), version + 1)
+
+    def test_stale_entry_is_recomputed_by_lock_holder(self):
+        self.assertEqual(get_or_compute_results(self.voting.id, lambda: 'first')[1], 'first')
+        self.assertEqual(get_or_compute_results(self.voting.id, lambda: 'second')[1], 'first')
+        bump_results_version(self.voting.id)
+        lock = f'results:lock:{self.voting.id}'
+        caches['results'].add(lock, 1)
+        self.assertEqual(get_or_compute_results(self.voting.id, lambda: 'second')[1], 'first')
+        self.assertTrue(caches['results'].get(lock))
+        caches['results'].delete(f'results:entry:{self.voting.id}')
+        self.assertEqual(get_or_compute_results(self.voting.id, lambda: 'second')[1], 'second')
+        self.assertTrue(caches['results'].get(lock))
+        caches['results'].delete(lock)
+        bump_results_version(self.voting.id)
+        self.assertEqual(get_or_compute_results(self.voting.id, lambda: 'third')[1], 'third')
+        self.assertIsNone(caches['results'].get(lock))
+
+    def test_writes_invalidate_on_commit(self):
+        version = get_results_version(self.voting.id)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.voting.vote(self.voting.author, [self.variant.id])
+        self.assertEqual(get_results_version(self.voting.id), version)
+        for callback in callbacks:
+            callback()
+        self.assertGreater(get_results_version(self.voting.id), version)
+        version = get_results_version(self.voting.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertNumQueries(2):
+                Variant.objects.create(text='Other', question=self.question)
+        self.assertEqual(get_results_version(self.voting.id), version + 1)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.author = get_user_model().objects.create_user('author', password='password')
+        self.in_title = Voting.objects.create(title='Python release', author=self.author, published=True)
+        self.in_question = Voting.objects.create(title='Weekend plans', author=self.author, published=True)
+        Question.objects.create(title='Which python?', description='', voting=self.in_question, type=1)
+        self.draft = Voting.objects.create(title='Python draft', author=self.author)
+
+    def test_to_match_quotes_words(self):
+        self.assertEqual(search.SQLiteFTSBackend.to_match('py"thon OR -x*'), '"py" "thon" "OR" "x"*')
+        self.assertEqual(search.SQLiteFTSBackend.to_match('"*'), '')
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite FTS5 only')
+    def test_fts_ranks_title_matches_first(self):
+        backend = search.SQLiteFTSBackend()
+        self.assertEqual(backend.search_votings('python', 10, 0), [self.in_title.id, self.in_question.id])
+        self.assertEqual(backend.search_votings('pyth', 10, 0), [self.in_title.id, self.in_question.id])
+        self.assertEqual(backend.search_votings('python', 1, 1), [self.in_question.id])
+        self.assertEqual(backend.search_votings('"python" OR', 10, 0), [])
+        self.assertEqual(backend.search_votings('', 10, 0), [])
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite FTS5 only')
+    def test_fts_index_follows_signals(self):
+        backend = search.SQLiteFTSBackend()
+        self.draft.publish()
+        self.assertIn(self.draft.id, backend.search_votings('draft', 10, 0))
+        Question.objects.create(title='Rust', description='', voting=self.draft, type=1)
+        self.assertEqual(backend.search_votings('rust', 10, 0), [self.draft.id])
+        complaint = Complaint.objects.create(user=self.author, voting=self.draft, text='Spam')
+        self.assertEqual(backend.search_complaints('spam', 10, 0), [complaint.id])
+        Complaint.block_votings([self.draft.id])
+        self.assertEqual(backend.search_votings('rust', 10, 0), [])
+        self.assertEqual(backend.search_complaints('spam', 10, 0), [])
+        self.in_title.delete()
+        self.assertEqual(backend.search_votings('python', 10, 0), [self.in_question.id])
+
+    def test_basic_backend(self):
+        backend = search.BasicSearchBackend()
+        self.assertEqual(set(backend.search_votings('python', 10, 0)), {self.in_title.id, self.in_question.id})
+        self.assertEqual(len(backend.search_votings('python', 1, 0)), 1)
+        complaint = Complaint.objects.create(user=self.author, voting=self.in_title, text='Spam')
+        self.assertEqual(backend.search_complaints('spa', 10, 0), [complaint.id])
+        Complaint.skip_votings([self.in_title.id])
+        self.assertEqual(backend.search_complaints('spa', 10, 0), [])
+
+
+class ModerationTests(TestCase):
+    def setUp(self):
+        caches['results'].clear()
+        self.author = get_user_model().objects.create_user('author', password='password')
+        self.users = [get_user_model().objects.create_user(f'user{i}', password='password') for i in range(3)]
+        self.votings = [
+            Voting.objects.create(title=f'Voting {i}', author=self.author, published=True) for i in range(3)
+        ]
+        for i, user in enumerate(self.users):
+            for voting in self.votings[:i + 1]:
+                Complaint.objects.create(user=user, voting=voting, text=f'Complaint {user.username}')
+
+    def test_complaint_groups(self):
+        groups = list(Complaint.get_complaint_groups())
+        self.assertEqual([voting.id for voting in groups], [voting.id for voting in self.votings])
+        self.assertEqual([voting.open_complaints for voting in groups], [3, 2, 1])
+        self.assertEqual(groups[0].last_complaint_text, 'Complaint user2')
+        Complaint.objects.filter(voting=self.votings[0], user=self.users[2]).update(is_active=False)
+        groups = list(Complaint.get_complaint_groups())
+        self.assertEqual([voting.id for voting in groups], [self.votings[i].id for i in (1, 0, 2)])
+        self.assertEqual([voting.open_complaints for voting in groups], [2, 2, 1])
+        self.assertEqual(groups[1].last_complaint_text, 'Complaint user1')
+
+    def test_block_and_skip(self):
+        versions = [get_results_version(voting.id) for voting in self.votings]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(Complaint.block_votings([self.votings[0].id]), 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(Complaint.skip_votings([self.votings[1].id]), 2)
+        self.assertEqual(
+            list(Voting.objects.order_by('id').values_list('blocked', flat=True)), [True, False, False]
+        )
+        self.assertEqual([voting.id for voting in Complaint.get_complaint_groups()], [self.votings[2].id])
+        self.assertEqual(
+            [get_results_version(voting.id) for voting in self.votings], [versions[0] + 1, versions[1], versions[2]]
+        )
+
+    def test_permissions(self):
+        url = reverse('moderation')
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(self.author)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(self.client.post(url, {'action': 'block', 'voting_id': self.votings[0].id}).status_code, 403)
+        self.assertFalse(Voting.objects.get(id=self.votings[0].id).blocked)
+        self.author.is_staff = True
+        self.author.save()
+        self.assertEqual(len(self.client.get(url).context['groups']), 3)
+        self.assertEqual(self.client.post(url, {'action': 'block', 'voting_id': self.votings[0].id}).status_code, 302)
+        self.assertTrue(Voting.objects.get(id=self.votings[0].id).blocked)
+        self.assertEqual(self.client.post(url, {'action': 'other', 'voting_id': self.votings[1].id}).status_code, 400)
+        self.assertEqual(self.client.post(url, {'action': 'skip', 'voting_id': 'x'}).status_code, 400)
+
+
+class RateLimitTests(TestCase):
+    def setUp(self):
+        caches['ratelimit'].clear()
+
+    def test_token_bucket(self):
+        self.assertEqual(ratelimit.parse_rate('30/m'), (30, 0.5))
+        bucket, wait = ratelimit.take_token(None, 2, 0.5, 100)
+        self.assertEqual((bucket, wait), ((1, 100), 0))
+        bucket, wait = ratelimit.take_token(bucket, 2, 0.5, 100)
+        self.assertEqual(wait, 0)
+        bucket, wait = ratelimit.take_token(bucket, 2, 0.5, 101)
+        self.assertEqual(wait, 1)
+        bucket, wait = ratelimit.take_token(bucket, 2, 0.5, 102)
+        self.assertEqual(wait, 0)
+        self.assertEqual(ratelimit.take_token(bucket, 2, 0.5, 1000)[0], (1, 1000))
+
+    def test_stores(self):
+        for store in (ratelimit.MemoryRateLimitStore(max_keys=2), ratelimit.CacheRateLimitStore()):
+            self.assertEqual(store.hit('a', 1, 1 / 60), 0)
+            self.assertAlmostEqual(store.hit('a', 1, 1 / 60), 60, delta=1)
+            self.assertEqual(store.hit('b', 1, 1 / 60), 0)
+        store = ratelimit.MemoryRateLimitStore(max_keys=2)
+        for key in ('a', 'b', 'c'):
+            store.hit(key, 1, 1 / 60)
+        self.assertEqual(list(store.buckets), ['b', 'c'])
+
+    @override_settings(RATE_LIMIT_ENABLED=True, RATE_LIMITS={'like': {'ip': '1/m'}})
+    def test_limited_response(self):
+        def view(request):
+            return HttpResponse()
+
+        async def async_view(request):
+            return HttpResponse()
+
+        with mock.patch.object(ratelimit, '_store', ratelimit.MemoryRateLimitStore()):
+            request = RequestFactory().post('/', REMOTE_ADDR='10.0.0.1')
+            self.assertEqual(ratelimit.rate_limit('like')(view)(request).status_code, 200)
+            response = ratelimit.rate_limit('like')(view)(request)
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response['Retry-After'], '60')
+            response = async_to_sync(ratelimit.rate_limit('like')(async_view))(request)
+            self.assertEqual(response.status_code, 429)
+            request = RequestFactory().post('/', REMOTE_ADDR='10.0.0.2')
+            self.assertEqual(async_to_sync(ratelimit.rate_limit('like')(async_view))(request).status_code, 200)
+            self.assertEqual(ratelimit.rate_limit('other')(view)(request).status_code, 200)
+
+    @override_settings(RATE_LIMIT_ENABLED=False)
+    def test_open_complaint_dedupe(self):
+        user = get_user_model().objects.create_user('user', password='password')
+        voting = Voting.objects.create(title='Voting', author=user, published=True)
+        self.assertFalse(Complaint.has_open_complaint(user, voting))
+        Complaint.objects.create(user=user, voting=voting, text='First')
+        self.assertTrue(Complaint.has_open_complaint(user, voting))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Complaint.objects.create(user=user, voting=voting, text='Second')
+        self.client.force_login(user)
+        url = reverse('create_complaint', kwargs={'id': voting.id})
+        self.assertRedirects(
+            self.client.post(url, {'text': 'Third'}), reverse('voting', kwargs={'id': voting.id}),
+            fetch_redirect_response=False,
+        )
+        with mock.patch.object(Complaint, 'has_open_complaint', return_value=False):
+            self.assertEqual(self.client.post(url, {'text': 'Third'}).status_code, 302)
+        self.assertEqual(Complaint.objects.filter(voting=voting).count(), 1)
+        Complaint.skip_votings([voting.id])
+        self.assertFalse(Complaint.has_open_complaint(user, voting))
+        Complaint.objects.create(user=user, voting=voting, text='Fourth')
+        self.assertEqual(Complaint.objects.filter(voting=voting).count(), 2)
+
+
+class MetricsTests(TestCase):
+    def test_request_is_observed(self):
+        user = get_user_model().objects.create_user('user', password='password')
+        Voting.objects.create(title='Voting', author=user, published=True)
+        self.client.force_login(user)
+        metrics.reset_metrics()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(reverse('list_votings')).status_code, 200)
+        executed = len(queries)
+        self.assertGreater(executed, 0)
+        self.assertEqual(metrics.request_duration.series['list_votings'][2], 1)
+        counts, total, count = metrics.request_queries.series['list_votings']
+        self.assertEqual((total, count), (executed, 1))
+        self.assertEqual(sum(counts), 1)
+        self.assertGreater(metrics.request_render_duration.series['list_votings'][1], 0)
+        output = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn(f'votings_request_queries_sum{{view="list_votings"}} {executed}', output)
+        self.assertIn('votings_request_queries_count{view="list_votings"} 1', output)
+        self.assertIn('votings_request_duration_seconds_bucket{view="list_votings",le="+Inf"} 1', output)
+
+
+class TallyTests(TestCase):
+    def setUp(self):
+        author = get_user_model().objects.create_user('author', password='password')
+        self.voters = [get_user_model().objects.create_user(f'voter{i}', password='password') for i in range(3)]
+        self.voting = Voting.objects.create(title='Voting', author=author, published=True)
+        self.questions = [
+            Question.objects.create(title=f'Question {i}', description='', voting=self.voting, type=type)
+            for i, type in enumerate((1, 2))
+        ]
+        self.variants = [
+            Variant.objects.create(text=f'Variant {i}', question=question)
+            for question in self.questions for i in range(2)
+        ]
+
+    def call(self, *args):
+        out = StringIO()
+        call_command('rebuild_tallies', *args, stdout=out)
+        return out.getvalue()
+
+    def test_tallies_match_facts(self):
+        self.voting.vote(self.voters[0], [self.variants[0].id, self.variants[2].id, self.variants[3].id])
+        self.voting.vote(self.voters[1], [self.variants[1].id, self.variants[3].id])
+        self.voting.vote(self.voters[2], [self.variants[0].id])
+        for variant in Variant.objects.all():
+            self.assertEqual(variant.votes_count, VoteFact.objects.filter(variant=variant).count())
+        for question in Question.objects.all():
+            self.assertEqual(question.votes_count, VoteFact.objects.filter(variant__question=question).count())
+        self.assertEqual([question.votes_count for question in Question.objects.order_by('id')], [3, 3])
+        self.assertIn('All tallies are up to date.', self.call('--verify'))
+
+    def test_verify_detects_drift_and_rebuild_fixes_it(self):
+        self.voting.vote(self.voters[0], [self.variants[0].id])
+        Variant.objects.filter(id=self.variants[0].id).update(votes_count=5)
+        Question.objects.filter(id=self.questions[1].id).update(votes_count=2)
+        UserActivity.objects.filter(user=self.voters[0]).update(voted_count=0)
+        with self.assertRaisesMessage(CommandError, '3 tallies are out of date'):
+            self.call('--verify')
+        self.assertIn('Rebuilt tallies', self.call())
+        self.assertIn('All tallies are up to date.', self.call('--verify'))
+        self.assertEqual(Variant.objects.get(id=self.variants[0].id).votes_count, 1)
+        self.assertEqual(Question.objects.get(id=self.questions[1].id).votes_count, 0)
+
+    def test_generated_data_is_consistent(self):
+        # 10 ballots in batches of 5: the last batch ends exactly with the last ballot.
+        call_command(
+            'generate_data', users=10, votings=1, votes=10, likes=5, batch_size=5, keep_indexes=True, stdout=StringIO()
+        )
+        self.assertIn('All tallies are up to date.', self.call('--verify'))
+
+
+@override_settings(RATE_LIMIT_ENABLED=False)
+class VoteSubmissionTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('user', password='password')
+        self.voting = Voting.objects.create(title='Voting', author=self.user, published=True)
+        single = Question.objects.create(title='Single', description='', voting=self.voting, type=1)
+        multiple = Question.objects.create(title='Multiple', description='', voting=self.voting, type=2)
+        self.single = [Variant.objects.create(text=f'Single {i}', question=single) for i in range(2)]
+        self.multiple = [Variant.objects.create(text=f'Multiple {i}', question=multiple) for i in range(2)]
+        other = Voting.objects.create(title='Other', author=self.user, published=True)
+        self.other = Variant.objects.create(
+            text='Other', question=Question.objects.create(title='Other', description='', voting=other, type=1)
+        )
+        self.client.force_login(self.user)
+
+    def submit(self, *variants):
+        return self.client.post(
+            reverse('voting', kwargs={'id': self.voting.id}), {'variant_id': [variant.id for variant in variants]}
+        )
+
+    def assert_votes(self, participants: int, facts: int):
+        self.assertEqual(Participation.objects.filter(voting=self.voting).count(), participants)
+        self.assertEqual(VoteFact.objects.filter(variant__question__voting=self.voting).count(), facts)
+        self.assertEqual(sum(Question.objects.filter(voting=self.voting).values_list('votes_count', flat=True)), facts)
+        self.assertEqual(Voting.objects.get(id=self.voting.id).votes_count, participants)
+
+    def test_invalid_variant_writes_nothing(self):
+        self.assertEqual(self.submit(self.single[0], self.other).status_code, 400)
+        self.assertEqual(self.client.post(reverse('voting', kwargs={'id': self.voting.id})).status_code, 400)
+        self.assertEqual(
+            self.client.post(reverse('voting', kwargs={'id': self.voting.id}), {'variant_id': 'x'}).status_code, 400
+        )
+        with mock.patch.object(UserActivity, 'add', side_effect=RuntimeError('Crash')):
+            with self.assertRaises(RuntimeError):
+                self.voting.vote(self.user, [self.single[0].id])
+        self.assert_votes(0, 0)
+        self.assertEqual(Variant.objects.get(id=self.single[0].id).votes_count, 0)
+
+    def test_double_submit_counts_once(self):
+        self.assertEqual(self.submit(self.single[0], *self.multiple).status_code, 302)
+        self.assertEqual(self.submit(self.single[1]).status_code, 302)
+        self.assertFalse(self.voting.vote(self.user, [self.single[1].id]))
+        self.assert_votes(1, 3)
+        self.assertEqual(Variant.objects.get(id=self.single[1].id).votes_count, 0)
+
+    def test_single_and_multiple_choice(self):
+        self.assertEqual(self.submit(*self.single).status_code, 400)
+        self.assert_votes(0, 0)
+        self.assertEqual(self.submit(self.single[1], *self.multiple).status_code, 302)
+        self.assert_votes(1, 3)
+
+    def test_closed_voting(self):
+        Voting.objects.filter(id=self.voting.id).update(blocked=True)
+        self.assertEqual(self.submit(self.single[0]).status_code, 400)
+        self.assert_votes(0, 0)
+
+
+@override_settings(ASYNC_VIEWS=True, RATE_LIMIT_ENABLED=False)
+class AsyncViewTests(TestCase):
+    # The URLconfs pick the views when imported, so they are reloaded with ASYNC_VIEWS on and again afterwards.
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reload_urls()
+        cls.addClassCleanup(cls.reload_urls)
+
+    @staticmethod
+    def reload_urls():
+        for name in ('votings.urls.votings', 'votings.urls.profile', 'votings.urls'):
+            importlib.reload(importlib.import_module(name))
+        clear_url_caches()
+
+    def setUp(self):
+        self.author = get_user_model().objects.create_user('author', password='password')
+        self.user = get_user_model().objects.create_user('user', password='password')
+        self.voting = Voting.objects.create(title='Voting', author=self.author, published=True)
+        question = Question.objects.create(title='Question', description='', voting=self.voting, type=1)
+        self.variant = Variant.objects.create(text='Variant', question=question)
+        caches['results'].clear()
+        caches['template_fragments'].clear()
+        self.client = AsyncClient()
+        self.client.force_login(self.user)
+
+    def test_urls_serve_async_views(self):
+        self.assertIs(resolve(reverse('like', kwargs={'id': self.voting.id})).func, async_views.like_voting)
+        self.assertIs(resolve(reverse('voting', kwargs={'id': self.voting.id})).func.view_class, async_views.VotingPage)
+
+    async def test_list_votings(self):
+        response = await self.client.get(reverse('list_votings'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([voting.id for voting in response.context['votings']], [self.voting.id])
+        self.assertEqual(response.context['liked_ids'], set())
+
+    async def test_login_required(self):
+        response = await AsyncClient().get(reverse('voting', kwargs={'id': self.voting.id}))
+        self.assertEqual(response.status_code, 302)
+
+    async def test_voting(self):
+        url = reverse('voting', kwargs={'id': self.voting.id})
+        response = await self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['voting'], self.voting)
+        self.assertFalse(response.context['voted'])
+        self.assertFalse(response.context['liked'])
+        self.assertEqual([question.title for question in response.context['questions']], ['Question'])
+        response = await self.client.post(url, {'variant_id': [self.variant.id]})
+        self.assertRedirects(response, url, fetch_redirect_response=False)
+        response = await self.client.get(url)
+        self.assertTrue(response.context['voted'])
+        self.assertEqual(response.context['voted_variant_ids'], {self.variant.id})
+        await sync_to_async(self.variant.refresh_from_db)()
+        self.assertEqual(self.variant.votes_count, 1)
+        self.assertEqual((await self.client.get(reverse('voting', kwargs={'id': 0}))).status_code, 404)
+
+    async def test_profile(self):
+        response = await self.client.get(reverse('profile', kwargs={'id': self.user.id}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['user'], self.user)
+        self.assertTrue(response.context['is_same_user'])
+        response = await self.client.get(reverse('profile', kwargs={'id': self.author.id}))
+        self.assertFalse(response.context['is_same_user'])
+
+    async def test_profile_sections(self):
+        await sync_to_async(self.voting.like)(self.user)
+        url = reverse('profile_section', kwargs={'id': self.author.id, 'section': 'votings'})
+        response = await self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([voting.id for voting in response.context['votings']], [self.voting.id])
+        response = await self.client.get(reverse('profile_section', kwargs={'id': self.user.id, 'section': 'liked'}))
+        self.assertEqual([voting.id for voting in response.context['votings']], [self.voting.id])
+        self.assertEqual(response.context['liked_ids'], {self.voting.id})
+        response = await self.client.get(reverse('profile_section', kwargs={'id': self.author.id, 'section': 'liked'}))
+        self.assertEqual(response.status_code, 403)
+        response = await self.client.get(reverse('profile_section', kwargs={'id': self.user.id, 'section': 'unknown'}))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_like_toggle(self):
+        url = reverse('like', kwargs={'id': self.voting.id})
+        response = await self.client.post(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), {'liked': True, 'likes_count': 1})
+        response = await self.client.post(url)
+        self.assertEqual(json.loads(response.content), {'liked': False, 'likes_count': 0})
+        await sync_to_async(self.voting.refresh_from_db)()
+        self.assertEqual(self.voting.likes_count, 0)
+        self.assertEqual((await self.client.get(url)).status_code, 405)
+        self.assertEqual((await AsyncClient().post(url)).status_code, 401)
+        self.assertEqual((await self.client.post(reverse('like', kwargs={'id': 0}))).status_code, 404)
+
+
+class FragmentCacheTests(TestCase):
+    def setUp(self):
+        caches['template_fragments'].clear()
+        caches['results'].clear()
+
+    def test_cards_are_shared_and_invalidated(self):
+        author = get_user_model().objects.create_user('author', password='password')
+        reader = get_user_model().objects.create_user('reader', password='password')
+        voting = Voting.objects.create(title='Voting', author=author, published=True)
+        self.client.force_login(author)
+        self.assertContains(self.client.get(reverse('list_votings')), 'Likes: 0')
+        Voting.objects.filter(id=voting.id).update(title='Renamed')
+        self.client.force_login(reader)
+        self.assertContains(self.client.get(reverse('list_votings')), 'Voting')
+        with self.captureOnCommitCallbacks(execute=True):
+            voting.like(reader)
+        response = self.client.get(reverse('list_votings'))
+        self.assertContains(response, 'Renamed')
+        self.assertContains(response, 'You liked it')
+        self.client.force_login(author)
+        response = self.client.get(reverse('list_votings'))
+        self.assertContains(response, 'Likes: 1')
+        self.assertNotContains(response, 'You liked it')
+
+    @override_settings(DATABASE_REPLICA_ALIASES=['default'])
+    def test_missing_cards_render_from_primary(self):
+        author = get_user_model().objects.create_user('author', password='password')
+        voting = Voting.objects.create(title='Voting', author=author, published=True)
+        stale = Voting.objects.get(id=voting.id)
+        voting.like(author)
+        token = replica_reads.set(True)
+        try:
+            views.prepare_cards(author, [stale])
+            self.assertEqual(stale.likes_count, 1)
+            caches['template_fragments'].set(
+                make_template_fragment_key('voting_card', [voting.id, stale.fragment_version]), 'Card'
+            )
+            stale.likes_count = 0
+            with self.assertNumQueries(1):
+                views.prepare_cards(author, [stale])
+            self.assertEqual(stale.likes_count, 0)
+        finally:
+            replica_reads.reset(token)
+
+    def test_results_overlay(self):
+        author = get_user_model().objects.create_user('author', password='password')
+        voting = Voting.objects.create(title='Voting', author=author, published=True)
+        question = Question.objects.create(title='Question', description='', voting=voting, type=1)
+        variants = [Variant.objects.create(text=f'Variant {i}', question=question) for i in range(2)]
+        with self.captureOnCommitCallbacks(execute=True):
+            voting.vote(author, [variants[1].id])
+        self.client.force_login(author)
+        response = self.client.get(reverse('voting', kwargs={'id': voting.id}))
+        self.assertContains(response, f'.progress[data-variant-id="{variants[1].id}"]')
+        self.assertNotContains(response, f'.progress[data-variant-id="{variants[0].id}"]')
+
+    def test_stale_results_are_not_cached_as_current(self):
+        author = get_user_model().objects.create_user('author', password='password')
+        reader = get_user_model().objects.create_user('reader', password='password')
+        voting = Voting.objects.create(title='Voting', author=author, published=True)
+        question = Question.objects.create(title='Question', description='', voting=voting, type=1)
+        variants = [Variant.objects.create(text=f'Variant {i}', question=question) for i in range(2)]
+        url = reverse('voting', kwargs={'id': voting.id})
+        with self.captureOnCommitCallbacks(execute=True):
+            voting.vote(author, [variants[0].id])
+        self.client.force_login(author)
+        self.assertContains(self.client.get(url), 'style="width: 100%"')
+        with self.captureOnCommitCallbacks(execute=True):
+            voting.vote(reader, [variants[1].id])
+        # Another worker is recomputing the results, this one serves the stale entry.
+        caches['results'].add(f'results:lock:{voting.id}', 1)
+        self.assertContains(self.client.get(url), 'style="width: 100%"')
+        caches['results'].delete(f'results:lock:{voting.id}')
+        response = self.client.get(url)
+        self.assertContains(response, 'style="width: 50%"', count=2)
+        self.assertNotContains(response, 'style="width: 100%"')
+
+
+@override_settings(RESULTS_STREAM_ENABLED=True, RESULTS_STREAM_MAX_TICKS_PER_SECOND=1000, RATE_LIMIT_ENABLED=False)
+class StreamingTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('author', password='password')
+        self.voting = Voting.objects.create(title='Voting', author=self.user, published=True)
+        question = Question.objects.create(title='Question', description='', voting=self.voting, type=1)
+        self.variant = Variant.objects.create(text='Variant', question=question)
+
+    async def test_hub_skips_deltas_in_snapshot(self):
+        hub = streaming.ResultsHub()
+        subscription = hub.subscribe(self.voting.id)
+        hub.publish(self.voting.id, {self.variant.id: 1})
+        hub.skip_published(subscription)
+        hub.publish(self.voting.id, {self.variant.id: 2})
+        hub.publish(self.voting.id + 1, {self.variant.id: 5})
+        hub.publish(self.voting.id, {self.variant.id: 1, 0: 1})
+        self.assertEqual(await subscription.next(1), {self.variant.id: 3, 0: 1})
+        self.assertIsNone(await subscription.next(0.01))
+        channel = hub.channels[self.voting.id]
+        hub.unsubscribe(self.voting.id, subscription)
+        await channel.task
+        self.assertEqual(hub.channels, {})
+
+    def test_closed_loop_does_not_fail_votes(self):
+        async def subscribe():
+            streaming.hub.subscribe(self.voting.id)
+
+        # A stream whose server loop has stopped, then a stream asked for under WSGI.
+        asyncio.run(subscribe())
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('results_stream', kwargs={'id': self.voting.id})).status_code, 404)
+        self.assertContains(self.client.get(reverse('voting', kwargs={'id': self.voting.id})), 'EventSource')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('voting', kwargs={'id': self.voting.id}), {'variant_id': self.variant.id}
+            )
+        self.assertEqual(response.status_code, 302)
+        self.assertNotIn(self.voting.id, streaming.hub.channels)
+        self.assertTrue(self.voting.is_user_voted(self.user))
+        with override_settings(RESULTS_STREAM_ENABLED=False):
+            self.assertNotContains(self.client.get(reverse('voting', kwargs={'id': self.voting.id})), 'EventSource')
+
+    async def test_stream(self):
+        self.assertEqual((await self.async_client.get(reverse('results_stream', kwargs={'id': 0}))).status_code, 401)
+        await sync_to_async(self.async_client.force_login)(self.user)
+        response = await self.async_client.get(reverse('results_stream', kwargs={'id': 0}))
+        self.assertEqual(response.status_code, 404)
+        await sync_to_async(self.voting.vote)(self.user, [self.variant.id])
+        hub = streaming.ResultsHub()
+        with mock.patch.object(views, 'hub', hub):
+            response = await self.async_client.get(reverse('results_stream', kwargs={'id': self.voting.id}))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = aiter(response.streaming_content)
+        try:
+            self.assertEqual(await anext(events), f'event: snapshot\ndata: {{"{self.variant.id}": 1}}\n\n'.encode())
+            hub.publish(self.voting.id, {self.variant.id: 1})
+            self.assertEqual(await anext(events), f'event: delta\ndata: {{"{self.variant.id}": 1}}\n\n'.encode())
+        finally:
+            for channel in hub.channels.values():
+                channel.task.cancel()
+
+
+@override_settings(DATABASE_REPLICA_ALIASES=['replica0'])
+class ReplicaRoutingTests(SimpleTestCase):
+    def read_alias(self, method: str, path: str, **cookies):
+        aliases = []
+
+        def get_response(request):
+            self.assertIsNone(ReplicaRouter().db_for_read(get_user_model()))
+            aliases.append(ReplicaRouter().db_for_read(Voting) or 'default')
+            return HttpResponse()
+
+        request = getattr(RequestFactory(), method)(path)
+        request.COOKIES.update(cookies)
+        response = ReplicaMiddleware(get_response)(request)
+        return aliases[0], response
+
+    def test_read_only_views_use_replica(self):
+        self.assertEqual(self.read_alias('get', reverse('list_votings'))[0], 'replica0')
+        self.assertEqual(self.read_alias('get', reverse('profile', kwargs={'id': 1}))[0], 'replica0')
+        self.assertEqual(self.read_alias('get', reverse('voting', kwargs={'id': 1}))[0], 'replica0')
+
+    def test_other_views_use_primary(self):
+        self.assertEqual(self.read_alias('get', reverse('complains_list'))[0], 'default')
+        self.assertEqual(self.read_alias('get', '/missing/')[0], 'default')
+
+    def test_unknown_path_uses_primary(self):
+        alias, response = self.read_alias('get', '/missing/')
+        self.assertEqual(alias, 'default')
+        self.assertNotIn(settings.REPLICA_PIN_COOKIE, response.cookies)
+        self.assertFalse(ReplicaMiddleware.reads_from_replica(RequestFactory().get('/missing/')))
+
+    def test_primary_reads(self):
+        token = replica_reads.set(True)
+        try:
+            with primary_reads():
+                self.assertIsNone(ReplicaRouter().db_for_read(Voting))
+            self.assertEqual(ReplicaRouter().db_for_read(Voting), 'replica0')
+        finally:
+            replica_reads.reset(token)
+        self.assertIsNone(ReplicaRouter().db_for_read(Voting))
+
+    def test_writes_pin_to_primary(self):
+        alias, response = self.read_alias('post', reverse('voting', kwargs={'id': 1}))
+        self.assertEqual(alias, 'default')
+        self.assertIn(settings.REPLICA_PIN_COOKIE, response.cookies)
+        pinned = {settings.REPLICA_PIN_COOKIE: '1'}
+        self.assertEqual(self.read_alias('get', reverse('voting', kwargs={'id': 1}), **pinned)[0], 'default')
+
+    def test_pin_cookie_ignored_on_writes(self):
+        pinned = {settings.REPLICA_PIN_COOKIE: '1'}
+        alias, response = self.read_alias('post', reverse('list_votings'), **pinned)
+        self.assertEqual(alias, 'default')
+        self.assertIn(settings.REPLICA_PIN_COOKIE, response.cookies)
+        self.assertEqual(self.read_alias('head', reverse('list_votings'))[0], 'replica0')
+
+    def test_no_replicas(self):
+        with override_settings(DATABASE_REPLICA_ALIASES=[]):
+            self.assertEqual(self.read_alias('get', reverse('list_votings'))[0], 'default')
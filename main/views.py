@@ -1,16 +1,55 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth import logout, get_user_model
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from django.core.exceptions import PermissionDenied
-from django.http import JsonResponse
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.core.handlers.asgi import ASGIRequest
+from django.db import IntegrityError, transaction
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import require_POST
 from django.views.generic import TemplateView, CreateView, ListView, View
+from main import ingestion, metrics, ranking, search
+from main.cache import get_fragment_versions, get_missing_fragment_ids
+from main.db import is_replica_read, primary_reads, reads_from_replica
 from main.forms import CreateVotingForm, CreateQuestionForm, CreateVariantForm, CreateComplaint
-from main.models import Voting, Question, Variant, VoteFact, Complaint
+from main.models import Voting, Question, Variant, Complaint, Like, Participation, UserActivity
+from main.pagination import KeysetPage
+from main.ratelimit import rate_limit
+from main.results import get_cached_results, get_voted_variant_ids
+from main.search import SearchPage
+from main.streaming import hub
 from votings.settings import BASE_URL
+import json
 import logging
+from typing import Dict, List
+from urllib.parse import urlencode
+
+
+def prepare_cards(user: get_user_model, votings: List[Voting]) -> Dict:
+    # Voting cards are cached per voting, the per user parts are overlaid from these sets.
+    if not votings:
+        return {'liked_ids': set(), 'voted_ids': set()}
+    ids = [voting.id for voting in votings]
+    versions = get_fragment_versions(ids)
+    for voting in votings:
+        voting.fragment_version = versions[voting.id]
+    if is_replica_read():
+        # A lagging replica must not fill a current fragment, missing ones render from the primary.
+        missing = get_missing_fragment_ids('voting_card', versions)
+        if missing:
+            with primary_reads():
+                fresh = Voting.objects.select_related('author').in_bulk(missing)
+            for voting in votings:
+                if voting.id in fresh:
+                    for field in ('title', 'likes_count', 'votes_count', 'author'):
+                        setattr(voting, field, getattr(fresh[voting.id], field))
+    liked_ids, voted_ids = Voting.get_liked_and_voted_ids(user, ids)
+    return {'liked_ids': liked_ids, 'voted_ids': voted_ids}
 
 
 class MainPage(TemplateView):
@@ -24,7 +63,7 @@ class MainPage(TemplateView):
         return context
 
     def render_to_response(self, context, **response_kwargs):
-        logging.info(f'User {self.request.user} visited main page.')
+        logging.info('User %s visited main page.', self.request.user)
         return super().render_to_response(context, **response_kwargs)
 
 
@@ -35,12 +74,12 @@ class SignUp(CreateView):
 
     def form_valid(self, form):
         response = super().form_valid(form)
-        logging.info(f'User {self.object} signed up.')
+        logging.info('User %s signed up.', self.object)
         return response
 
     def form_invalid(self, form):
         response = super().form_invalid(form)
-        logging.error(f'User {self.object} failed to sign up.')
+        logging.error('User %s failed to sign up.', self.object)
         return response
 
     def get_context_data(self, **kwargs):
@@ -51,33 +90,96 @@ class SignUp(CreateView):
         return context
 
     def render_to_response(self, context, **response_kwargs):
-        logging.info(f'User {self.request.user} visited sign up page.')
+        logging.info('User %s visited sign up page.', self.request.user)
         return super().render_to_response(context, **response_kwargs)
 
 
 def logout_view(request):
     logout(request)
-    logging.info(f'User {request.user} logged out.')
+    logging.info('User %s logged out.', request.user)
     return redirect('index')
 
 
 class ListVotingsPage(LoginRequiredMixin, ListView):
     template_name = 'votings/list.html'
     context_object_name = 'votings'
-    queryset = Voting.get_active_votings()
+    paginate_by = 20
+    replica_reads = True
+
+    def get_queryset(self):
+        return Voting.get_active_votings()
+
+    def get_search_query(self) -> str:
+        return self.request.GET.get('q', '').strip()
+
+    def get_sort(self) -> str:
+        return self.request.GET.get('sort', 'new')
+
+    def get_keyset_fields(self) -> tuple:
+        field = ranking.get_feed_field(self.get_sort())
+        if field is None:
+            raise Http404('Unknown sort')
+        return field, 'id'
+
+    def get_search_page(self, queryset, page_size) -> SearchPage:
+        return SearchPage(
+            search.get_backend().search_votings, queryset, self.get_search_query(), self.request.GET.get('page'),
+            page_size,
+        )
+
+    def paginate_queryset(self, queryset, page_size):
+        if self.get_search_query():
+            page = self.get_search_page(queryset, page_size)
+        else:
+            page = KeysetPage(queryset, self.get_keyset_fields(), self.request.GET.get('cursor'), page_size)
+        return None, page, page.object_list, page.has_next
 
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super().get_context_data(object_list=object_list, **kwargs)
+        next_query = context['page_obj'].next_query
+        if next_query and not self.get_search_query() and self.get_sort() != 'new':
+            next_query = f'{urlencode({"sort": self.get_sort()})}&{next_query}'
         context.update({
             'title': 'List Votings',
+            'query': self.get_search_query(),
+            'sort': self.get_sort(),
+            'next_query': next_query,
+            **self.get_card_context(context['votings']),
         })
         return context
 
+    def get_card_context(self, votings: List[Voting]) -> Dict:
+        return prepare_cards(self.request.user, votings)
+
     def render_to_response(self, context, **response_kwargs):
-        logging.info(f'User {self.request.user} visited list votings page.')
+        logging.info('User %s visited list votings page.', self.request.user)
         return super().render_to_response(context, **response_kwargs)
 
 
+class ListVotingsJson(ListVotingsPage):
+    def get_card_context(self, votings: List[Voting]) -> Dict:
+        return {}
+
+    def render_to_response(self, context, **response_kwargs):
+        votings = [
+            {
+                'id': voting.id,
+                'title': voting.title,
+                'author': voting.author.username,
+                'created_at': voting.created_at.isoformat(),
+                'likes_count': voting.likes_count,
+                'votes_count': voting.votes_count,
+                'url': reverse('voting', kwargs={'id': voting.id}),
+            }
+            for voting in context['votings']
+        ]
+        return JsonResponse({
+            'votings': votings,
+            'next_cursor': getattr(context['page_obj'], 'next_cursor', None),
+            'next_query': context['next_query'],
+        }, status=200)
+
+
 class CreateVotingPage(LoginRequiredMixin, CreateView):
     form_class = CreateVotingForm
     template_name = 'votings/create_voting.html'
@@ -99,12 +201,12 @@ class CreateVotingPage(LoginRequiredMixin, CreateView):
 
     def form_valid(self, form):
         response = super().form_valid(form)
-        logging.info(f'User {self.request.user} created voting {self.object}.')
+        logging.info('User %s created voting %s.', self.request.user, self.object)
         return response
 
     def form_invalid(self, form):
         response = super().form_invalid(form)
-        logging.error(f'User {self.request.user} failed to create voting.')
+        logging.error('User %s failed to create voting.', self.request.user)
         return response
 
 
@@ -133,15 +235,15 @@ class CreateQuestionPage(LoginRequiredMixin, CreateView):
     def form_valid(self, form):
         voting = form.instance.voting
         if len(voting.get_questions()) > 0:
-            logging.error(f'User {self.request.user} failed to create second question for voting {voting}.')
+            logging.error('User %s failed to create second question for voting %s.', self.request.user, voting)
             raise PermissionDenied()
         response = super().form_valid(form)
-        logging.info(f'User {self.request.user} created question {self.object}.')
+        logging.info('User %s created question %s.', self.request.user, self.object)
         return response
 
     def form_invalid(self, form):
         response = super().form_invalid(form)
-        logging.error(f'User {self.request.user} failed to create question.')
+        logging.error('User %s failed to create question.', self.request.user)
         return response
 
 
@@ -169,17 +271,18 @@ class CreateVariantsPage(LoginRequiredMixin, CreateView):
 
     def form_valid(self, form):
         response = super().form_valid(form)
-        logging.info(f'User {self.request.user} created variant {self.object}.')
+        logging.info('User %s created variant %s.', self.request.user, self.object)
         return response
 
     def form_invalid(self, form):
         response = super().form_invalid(form)
-        logging.error(f'User {self.request.user} failed to create variant.')
+        logging.error('User %s failed to create variant.', self.request.user)
         return response
 
 
 class VotingPage(LoginRequiredMixin, TemplateView):
     template_name = 'votings/voting.html'
+    replica_reads = True
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -187,23 +290,39 @@ class VotingPage(LoginRequiredMixin, TemplateView):
             'title': 'Voting',
             'BASE_URL': BASE_URL,
         })
-        voting = get_object_or_404(Voting, id=self.kwargs['id'])
+        voting = get_object_or_404(Voting.objects.select_related('author'), id=self.kwargs['id'])
+        voted_variant_ids = get_voted_variant_ids(voting, self.request.user)
+        if not voted_variant_ids and ingestion.is_enabled():
+            voted_variant_ids = ingestion.get_pending_variant_ids(voting, self.request.user)
         context['voting'] = voting
-        context['questions'] = voting.get_questions()
-        context['voted'] = voting.is_user_voted(self.request.user)
+        context['results_version'], context['questions'] = get_cached_results(voting)
+        context['liked'] = voting.id in Voting.get_liked_ids(self.request.user, [voting.id])
+        context['results_stream'] = settings.RESULTS_STREAM_ENABLED
+        context['voted'] = len(voted_variant_ids) > 0
+        context['voted_variant_ids'] = voted_variant_ids
         return context
 
+    @method_decorator(rate_limit('vote'))
     def post(self, request, *args, **kwargs):
         voting = get_object_or_404(Voting, id=self.kwargs['id'])
-        if not voting.is_user_voted(request.user):
-            keys = request.POST.getlist('variant_id')
-            for key in keys:
-                variant = get_object_or_404(Variant, id=key)
-                VoteFact.vote(request.user, variant)
+        try:
+            voted = ingestion.submit_vote(voting, request.user, request.POST.getlist('variant_id'))
+        except ValidationError as error:
+            logging.error('User %s sent invalid vote for voting %s: %s', request.user, voting, error.message)
+            return HttpResponseBadRequest(error.message)
+        except ingestion.VoteQueueFull:
+            logging.error('Votes queue is full, vote of user %s for voting %s rejected.', request.user, voting)
+            response = HttpResponse('Too many votes right now, please try again.', status=503)
+            response['Retry-After'] = '1'
+            return response
+        if voted:
+            logging.info('User %s voted in voting %s.', request.user, voting)
+        else:
+            logging.error('User %s tried to vote in voting %s twice.', request.user, voting)
         return redirect('voting', id=voting.id)
 
     def render_to_response(self, context, **response_kwargs):
-        logging.info(f'User {self.request.user} visited voting {context["voting"]}.')
+        logging.info('User %s visited voting %s.', self.request.user, context['voting'])
         return super().render_to_response(context, **response_kwargs)
 
 
@@ -211,10 +330,10 @@ class VotingPage(LoginRequiredMixin, TemplateView):
 def publish_voting(request, id: int):
     voting = get_object_or_404(Voting, id=id)
     if voting.author != request.user:
-        logging.error(f'User {request.user} failed to publish voting {voting}.')
+        logging.error('User %s failed to publish voting %s.', request.user, voting)
         raise PermissionDenied()
     voting.publish()
-    logging.info(f'User {request.user} published voting {voting}.')
+    logging.info('User %s published voting %s.', request.user, voting)
     return redirect('voting', id=voting.id)
 
 
@@ -234,52 +353,104 @@ class QuestionPage(LoginRequiredMixin, TemplateView):
         return context
 
     def render_to_response(self, context, **response_kwargs):
-        logging.info(f'User {self.request.user} visited question {context['question']}')
+        logging.info('User %s visited question %s', self.request.user, context['question'])
         return super().render_to_response(context, **response_kwargs)
 
 
 class ProfilePage(LoginRequiredMixin, TemplateView):
     template_name = 'profile/profile.html'
+    replica_reads = True
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         user = get_object_or_404(get_user_model(), id=self.kwargs['id'])
-        is_same_user = user == self.request.user
-        votings_of_user = Voting.get_votings_of_user(user)
-        liked_votings = Voting.get_liked_votings(user)
-        voted_votings = Voting.get_voted_votings(user)
         context.update({
             'title': 'Profile',
             'user': user,
-            'is_same_user': is_same_user,
-            'votings_of_user': votings_of_user,
-            'liked_votings': liked_votings,
-            'voted_votings': voted_votings,
+            'is_same_user': user == self.request.user,
+            'activity': UserActivity.get_for(user),
         })
         return context
 
     def render_to_response(self, context, **response_kwargs):
-        logging.info(f'User {self.request.user} visited {context['user']}\'s profile.')
+        logging.info('User %s visited %s\'s profile.', self.request.user, context['user'])
         return super().render_to_response(context, **response_kwargs)
 
 
+class ProfileSectionPage(LoginRequiredMixin, TemplateView):
+    # One page of a profile accordion section, fetched when the section is opened.
+    template_name = 'profile/section.html'
+    paginate_by = 20
+    replica_reads = True
+    SECTIONS = ('votings', 'liked', 'voted')
+
+    def get_section(self, user: get_user_model):
+        section = self.kwargs['section']
+        if section not in self.SECTIONS:
+            raise Http404('Unknown profile section')
+        if section == 'votings':
+            return Voting.get_votings_of_user(user), ('id',)
+        if user != self.request.user:
+            raise PermissionDenied()
+        rows = Like.get_liked_by(user) if section == 'liked' else Participation.get_voted_by(user)
+        return rows, ('voting_id',)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        user = get_object_or_404(get_user_model(), id=self.kwargs['id'])
+        queryset, fields = self.get_section(user)
+        page = KeysetPage(queryset, fields, self.request.GET.get('cursor'), self.paginate_by)
+        votings = self.get_votings(page)
+        return self.get_page_context(context, page, votings, prepare_cards(self.request.user, votings))
+
+    @staticmethod
+    def get_votings(page: KeysetPage) -> List[Voting]:
+        return [item if isinstance(item, Voting) else item.voting for item in page]
+
+    def get_page_context(self, context, page: KeysetPage, votings: List[Voting], cards: Dict):
+        context.update({
+            'votings': votings,
+            'next_url': f'{self.request.path}?{page.next_query}' if page.has_next else None,
+            **cards,
+        })
+        return context
+
+
 class ListComplainsPage(UserPassesTestMixin, LoginRequiredMixin, ListView):
     template_name = 'complains/list.html'
     context_object_name = 'complains'
-    queryset = Complaint.get_opened_complains()
+    paginate_by = 20
 
     def test_func(self):
         return self.request.user.is_staff
 
+    def get_queryset(self):
+        return Complaint.get_opened_complains().select_related('user', 'voting')
+
+    def get_search_query(self) -> str:
+        return self.request.GET.get('q', '').strip()
+
+    def paginate_queryset(self, queryset, page_size):
+        query = self.get_search_query()
+        if query:
+            page = SearchPage(
+                search.get_backend().search_complaints, queryset, query, self.request.GET.get('page'), page_size
+            )
+        else:
+            page = KeysetPage(queryset, ('id',), self.request.GET.get('cursor'), page_size)
+        return None, page, page.object_list, page.has_next
+
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super().get_context_data(object_list=object_list, **kwargs)
         context.update({
             'title': 'List Complains',
+            'query': self.get_search_query(),
+            'next_query': context['page_obj'].next_query,
         })
         return context
 
     def render_to_response(self, context, **response_kwargs):
-        logging.info(f'User {self.request.user} visited complaints page.')
+        logging.info('User %s visited complaints page.', self.request.user)
         return super().render_to_response(context, **response_kwargs)
 
 
@@ -308,7 +479,47 @@ class ComplaintPage(UserPassesTestMixin, LoginRequiredMixin, TemplateView):
         return redirect('complains_list')
 
     def render_to_response(self, context, **response_kwargs):
-        logging.info(f'User {self.request.user} visited complaint {context['complaint']}')
+        logging.info('User %s visited complaint %s', self.request.user, context['complaint'])
+        return super().render_to_response(context, **response_kwargs)
+
+
+class ModerationPage(UserPassesTestMixin, LoginRequiredMixin, ListView):
+    template_name = 'complains/moderation.html'
+    context_object_name = 'groups'
+    paginate_by = 20
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get_queryset(self):
+        return Complaint.get_complaint_groups()
+
+    def get_context_data(self, *, object_list=None, **kwargs):
+        context = super().get_context_data(object_list=object_list, **kwargs)
+        context.update({
+            'title': 'Moderation',
+        })
+        return context
+
+    def post(self, request, *args, **kwargs):
+        action = request.POST.get('action')
+        try:
+            voting_ids = [int(voting_id) for voting_id in request.POST.getlist('voting_id')]
+        except ValueError:
+            return HttpResponseBadRequest('Invalid voting id.')
+        if action == 'block':
+            closed = Complaint.block_votings(voting_ids)
+        elif action == 'skip':
+            closed = Complaint.skip_votings(voting_ids)
+        else:
+            return HttpResponseBadRequest('Unknown action.')
+        logging.info(
+            'User %s applied %s to votings %s, closed %s complaints.', request.user, action, voting_ids, closed
+        )
+        return redirect(request.get_full_path())
+
+    def render_to_response(self, context, **response_kwargs):
+        logging.info('User %s visited moderation page.', self.request.user)
         return super().render_to_response(context, **response_kwargs)
 
 
@@ -326,14 +537,33 @@ class CreateComplaintPage(LoginRequiredMixin, CreateView):
             'voting': voting
         }
 
+    @method_decorator(rate_limit('complaint'))
+    def post(self, request, *args, **kwargs):
+        voting = get_object_or_404(Voting, id=self.kwargs['id'])
+        if Complaint.has_open_complaint(request.user, voting):
+            logging.info('User %s already has an open complaint to voting %s.', request.user, voting)
+            return redirect(self.get_success_url())
+        return super().post(request, *args, **kwargs)
+
+    def get_form(self, form_class=None):
+        form = super().get_form(form_class)
+        form.instance.user = self.request.user
+        form.instance.voting_id = self.kwargs['id']
+        return form
+
     def form_valid(self, form):
-        response = super().form_valid(form)
-        logging.info(f'User {self.request.user} created complaint {self.object}.')
+        try:
+            with transaction.atomic():
+                response = super().form_valid(form)
+        except IntegrityError:
+            logging.info('User %s already has an open complaint to voting %s.', self.request.user, self.kwargs['id'])
+            return redirect(self.get_success_url())
+        logging.info('User %s created complaint %s.', self.request.user, self.object)
         return response
 
     def form_invalid(self, form):
         response = super().form_invalid(form)
-        logging.error(f'User {self.request.user} failed to create complaint.')
+        logging.error('User %s failed to create complaint.', self.request.user)
         return response
 
     def get_context_data(self, **kwargs):
@@ -344,12 +574,74 @@ class CreateComplaintPage(LoginRequiredMixin, CreateView):
         return context
 
 
+async def results_stream(request, id: int):
+    if not settings.RESULTS_STREAM_ENABLED or not isinstance(request, ASGIRequest):
+        return JsonResponse({'message': 'Streaming is not enabled'}, status=404)
+    is_authenticated = await sync_to_async(lambda: request.user.is_authenticated)()
+    if not is_authenticated:
+        return JsonResponse({'message': 'Login required'}, status=401)
+    if not await Voting.objects.filter(id=id, published=True).aexists():
+        return JsonResponse({'message': 'Invalid id'}, status=404)
+    # Subscribed before the snapshot so that no vote is missed, see ResultsHub.
+    subscription = hub.subscribe(id)
+    hub.skip_published(subscription)
+    tallies = {
+        variant_id: votes_count
+        async for variant_id, votes_count in Variant.objects.filter(question__voting_id=id).values_list(
+            'id', 'votes_count'
+        )
+    }
+
+    async def events():
+        try:
+            yield f'event: snapshot\ndata: {json.dumps(tallies)}\n\n'
+            while True:
+                deltas = await subscription.next(settings.RESULTS_STREAM_KEEPALIVE)
+                if deltas is None:
+                    yield ': keepalive\n\n'
+                else:
+                    yield f'event: delta\ndata: {json.dumps(deltas)}\n\n'
+        finally:
+            hub.unsubscribe(id, subscription)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@require_POST
+@rate_limit('like')
 def like_voting(request, id: int):
-    voting = None
-    try:
-        voting = Voting.objects.get(id=id)
-        voting.like(request.user)
-        logging.info(f'User {request.user} liked voting {voting}')
-    except:
+    if not request.user.is_authenticated:
+        return JsonResponse({'message': 'Login required'}, status=401)
+    voting = Voting.objects.filter(id=id).first()
+    if voting is None:
         return JsonResponse({'message': 'Invalid id'}, status=404)
-    return JsonResponse({'count likes': voting.get_likes_count()}, status=200)
+    liked = voting.like(request.user)
+    logging.info('User %s %s voting %s', request.user, 'liked' if liked else 'unliked', voting)
+    return JsonResponse({'liked': liked, 'likes_count': voting.likes_count}, status=200)
+
+
+def metrics_view(request):
+    if not settings.METRICS_ENABLED or request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        raise Http404
+    return HttpResponse(metrics.render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@reads_from_replica
+def likes_state(request):
+    if not request.user.is_authenticated:
+        return JsonResponse({'message': 'Login required'}, status=401)
+    try:
+        ids = {int(id) for id in request.GET.get('ids', '').split(',') if id}
+    except ValueError:
+        return JsonResponse({'message': 'Invalid ids'}, status=400)
+    if len(ids) > 100:
+        return JsonResponse({'message': 'Too many ids'}, status=400)
+    counts = dict(Voting.objects.filter(id__in=ids).values_list('id', 'likes_count'))
+    liked = Voting.get_liked_ids(request.user, counts.keys())
+    likes = {
+        id: {'liked': id in liked, 'likes_count': count} for id, count in counts.items()
+    }
+    return JsonResponse({'likes': likes}, status=200)
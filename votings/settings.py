@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 from pathlib import Path
 from django.conf.global_settings import LOGIN_URL
 import logging
+import os
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -43,6 +44,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'main.middleware.MetricsMiddleware',
+    'main.middleware.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -77,15 +80,128 @@ WSGI_APPLICATION = 'votings.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
+# DATABASE_PROFILE picks one of DATABASE_PROFILES. Connections persist for DB_CONN_MAX_AGE
+# seconds per worker thread. SQLite connections get SQLITE_PRAGMAS when they open, see
+# main/db.py. PostgreSQL connections (psycopg needed) are health checked before reuse;
+# set POSTGRES_PGBOUNCER=1 when they go through PgBouncer in transaction pooling mode.
 
-DATABASES = {
-    'default': {
+DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'sqlite')
+
+DATABASE_PROFILES = {
+    'sqlite': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', '60')),
+        'OPTIONS': {
+            'timeout': 20,
+        },
+    },
+    'postgresql': {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('POSTGRES_DB', 'votings'),
+        'USER': os.environ.get('POSTGRES_USER', 'votings'),
+        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+        'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', '60')),
+        'CONN_HEALTH_CHECKS': True,
+        'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('POSTGRES_PGBOUNCER', '0') == '1',
+        'OPTIONS': {
+            'connect_timeout': 5,
+        },
+    },
+}
+
+DATABASES = {
+    'default': DATABASE_PROFILES[DATABASE_PROFILE],
+}
+
+# Read replicas
+# DATABASE_REPLICAS lists replica databases, as file paths for SQLite or host names for
+# PostgreSQL. Safe requests to views marked with main.db.reads_from_replica read from
+# them, except for REPLICA_PIN_SECONDS after a user's own write. Tests mirror them to default.
+
+DATABASE_REPLICA_ALIASES = []
+for index, replica in enumerate(filter(None, os.environ.get('DATABASE_REPLICAS', '').split(','))):
+    DATABASE_REPLICA_ALIASES.append(f'replica{index}')
+    DATABASES[f'replica{index}'] = {
+        **DATABASES['default'],
+        'NAME' if DATABASE_PROFILE == 'sqlite' else 'HOST': replica,
+        'TEST': {'MIRROR': 'default'},
     }
+
+DATABASE_ROUTERS = ['main.db.ReplicaRouter']
+REPLICA_PIN_COOKIE = 'primary_pin'
+REPLICA_PIN_SECONDS = 10
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'busy_timeout': 20000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+    'temp_store': 'memory',
+}
+
+
+# Cache
+# The results cache keeps rendered voting results, see main/cache.py.
+# RESULTS_CACHE_BACKEND is one of RESULTS_CACHE_BACKENDS, e.g. 'redis' with
+# RESULTS_CACHE_LOCATION = 'redis://localhost:6379/1'. The template_fragments cache keeps
+# the HTML of voting cards and results blocks for the {% cache %} tag, configured the same way.
+
+RESULTS_CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'results': {
+        'BACKEND': RESULTS_CACHE_BACKENDS[os.environ.get('RESULTS_CACHE_BACKEND', 'locmem')],
+        'LOCATION': os.environ.get('RESULTS_CACHE_LOCATION', 'results'),
+        'TIMEOUT': 24 * 60 * 60,
+    },
+    'template_fragments': {
+        'BACKEND': RESULTS_CACHE_BACKENDS[os.environ.get('FRAGMENT_CACHE_BACKEND', 'locmem')],
+        'LOCATION': os.environ.get('FRAGMENT_CACHE_LOCATION', 'template_fragments'),
+        'TIMEOUT': 24 * 60 * 60,
+    },
+    'ratelimit': {
+        'BACKEND': RESULTS_CACHE_BACKENDS[os.environ.get('RATE_LIMIT_CACHE_BACKEND', 'locmem')],
+        'LOCATION': os.environ.get('RATE_LIMIT_CACHE_LOCATION', 'ratelimit'),
+    },
+}
+
+RESULTS_CACHE_LOCK_TIMEOUT = 10
+
+
+# Rate limiting
+# Token buckets per endpoint, keyed by client IP and by user, rates are 'count/period'
+# with period one of s, m, h, d. MemoryRateLimitStore keeps buckets per process,
+# main.ratelimit.CacheRateLimitStore shares them through the 'ratelimit' cache.
+
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT', '1') == '1'
+RATE_LIMIT_STORE = os.environ.get('RATE_LIMIT_STORE', 'main.ratelimit.MemoryRateLimitStore')
+RATE_LIMITS = {
+    'like': {'ip': '120/m', 'user': '30/m'},
+    'vote': {'ip': '60/m', 'user': '10/m'},
+    'complaint': {'ip': '20/h', 'user': '5/h'},
 }
 
 
+# Search
+# SQLiteFTSBackend needs the FTS5 tables created by migration 0010 on SQLite,
+# main.search.BasicSearchBackend serves other databases.
+
+SEARCH_BACKEND = {
+    'sqlite': 'main.search.SQLiteFTSBackend',
+}.get(DATABASE_PROFILE, 'main.search.BasicSearchBackend')
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -127,10 +243,76 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Votes ingestion
+# With ENABLED, VotingPage puts ballots on a queue and a background writer saves them in batches.
+# BACKEND is 'local' (in-process queue and writer thread) or 'redis' (shared queue, run the
+# run_vote_writer command as the writer and START_WRITER = False in web processes).
+
+VOTE_INGESTION = {
+    'ENABLED': os.environ.get('VOTE_INGESTION', '0') == '1',
+    'BACKEND': os.environ.get('VOTE_INGESTION_BACKEND', 'local'),
+    'REDIS_URL': os.environ.get('VOTE_INGESTION_REDIS_URL', 'redis://localhost:6379/0'),
+    'START_WRITER': os.environ.get('VOTE_INGESTION_START_WRITER', '1') == '1',
+    'MAX_QUEUE_SIZE': 10000,
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': 0.05,
+    'PUT_TIMEOUT': 0.1,
+    'PENDING_TIMEOUT': 60,
+}
+
+# Ballots still on the queue are marked in the 'pending_votes' cache, which every web process and
+# the writer have to share: with the redis backend it defaults to the Redis at REDIS_URL.
+
+CACHES['pending_votes'] = {
+    'BACKEND': RESULTS_CACHE_BACKENDS[os.environ.get(
+        'VOTE_INGESTION_PENDING_CACHE_BACKEND', 'redis' if VOTE_INGESTION['BACKEND'] == 'redis' else 'locmem'
+    )],
+    'LOCATION': os.environ.get(
+        'VOTE_INGESTION_PENDING_CACHE_LOCATION',
+        VOTE_INGESTION['REDIS_URL'] if VOTE_INGESTION['BACKEND'] == 'redis' else 'pending_votes',
+    ),
+    'KEY_PREFIX': 'pending_votes',
+}
+
+# Serve the read-heavy pages (voting list, voting, profile, like) from main/async_views.py.
+# Only useful under an ASGI server, compare with: manage.py bench_async_views
+
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS', '0') == '1'
+
+# Live results
+# Votes are pushed to the results stream subscribers at most this many times per second.
+# Streaming needs an ASGI server, e.g. uvicorn votings.asgi:application, set RESULTS_STREAM=1
+# there. Under WSGI a stream would hold a worker thread for good, so it answers 404.
+
+RESULTS_STREAM_ENABLED = os.environ.get('RESULTS_STREAM', '0') == '1'
+RESULTS_STREAM_MAX_TICKS_PER_SECOND = 4
+RESULTS_STREAM_KEEPALIVE = 15
+
+# Rankings
+# Votes and likes add WEIGHTS to the trending score of a voting, which halves every
+# HALF_LIFE_HOURS. After changing either, run the rebuild_rankings command, it also repairs
+# the like and vote counters behind the most liked and most voted feeds.
+
+RANKING = {
+    'HALF_LIFE_HOURS': float(os.environ.get('RANKING_HALF_LIFE_HOURS', '24')),
+    'WEIGHTS': {'vote': 1.0, 'like': 0.5},
+}
+
 LOGIN_REDIRECT_URL = '/'
 LOGIN_URL = '/login/'
 
+# Metrics
+# MetricsMiddleware keeps per view histograms of latency, SQL queries, SQL time and
+# template render time in process memory, served in Prometheus text format at /metrics/
+# to METRICS_ALLOWED_IPS. Each request is also logged at METRICS_LOG_LEVEL.
+
+METRICS_ENABLED = os.environ.get('METRICS', '1') == '1'
+METRICS_ALLOWED_IPS = os.environ.get('METRICS_ALLOWED_IPS', '127.0.0.1').split(',')
+METRICS_LOG_LEVEL = logging.getLevelName(os.environ.get('METRICS_LOG_LEVEL', 'DEBUG'))
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+
 logging.basicConfig(
-    level=logging.DEBUG,
+    level=LOG_LEVEL,
     format='[%(levelname)s] %(asctime)s: %(message)s',
 )
@@ -25,6 +25,7 @@ urlpatterns = [
     path('login/', auth_views.LoginView.as_view(), name='login'),
     path('logout/', views.logout_view, name='logout'),
     path('signup/', views.SignUp.as_view(), name='signup'),
+    path('metrics/', views.metrics_view, name='metrics'),
 
     path('votings/', include('votings.urls.votings')),
     path('profile/', include('votings.urls.profile')),
@@ -3,6 +3,7 @@ from main import views
 
 urlpatterns = [
     path('list/', views.ListComplainsPage.as_view(), name='complains_list'),
+    path('moderation/', views.ModerationPage.as_view(), name='moderation'),
     path('<int:id>/', views.ComplaintPage.as_view(), name='complaint'),
     path('create/<int:id>/', views.CreateComplaintPage.as_view(), name='create_complaint'),
 ]
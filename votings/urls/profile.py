@@ -1,9 +1,13 @@
+from django.conf import settings
 from django.urls import path
-from main import views
+from main import async_views, views
 from django.contrib.auth import views as auth_views
 
+pages = async_views if settings.ASYNC_VIEWS else views
+
 urlpatterns = [
-    path('<int:id>/', views.ProfilePage.as_view(), name='profile'),
+    path('<int:id>/', pages.ProfilePage.as_view(), name='profile'),
+    path('<int:id>/<slug:section>/', pages.ProfileSectionPage.as_view(), name='profile_section'),
     path('reset_password/', auth_views.PasswordResetView.as_view(), name='reset_password'),
     path('reset_password_sent/', auth_views.PasswordResetDoneView.as_view(), name='password_reset_done'),
     path('reset/<uidb64>/<token>/', auth_views.PasswordResetConfirmView.as_view(), name='password_reset_confirm'),
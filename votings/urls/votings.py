@@ -1,13 +1,19 @@
+from django.conf import settings
 from django.urls import path
-from main import views
+from main import async_views, views
+
+pages = async_views if settings.ASYNC_VIEWS else views
 
 urlpatterns = [
-    path('list/', views.ListVotingsPage.as_view(), name='list_votings'),
+    path('list/', pages.ListVotingsPage.as_view(), name='list_votings'),
+    path('list/json/', pages.ListVotingsJson.as_view(), name='list_votings_json'),
     path('create_voting/', views.CreateVotingPage.as_view(), name='create_voting'),
     path('<int:id>/create_questions/', views.CreateQuestionPage.as_view(), name='create_questions'),
     path('<int:id>/create_variants/', views.CreateVariantsPage.as_view(), name='create_variants'),
-    path('<int:id>/', views.VotingPage.as_view(), name='voting'),
+    path('<int:id>/', pages.VotingPage.as_view(), name='voting'),
+    path('<int:id>/stream/', views.results_stream, name='results_stream'),
     path('<int:id>/publish/', views.publish_voting, name='publish_voting'),
     path('question/<int:id>/', views.QuestionPage.as_view(), name='question'),
-    path('<int:id>/like/', views.like_voting, name='like'),
+    path('<int:id>/like/', pages.like_voting, name='like'),
+    path('likes/', views.likes_state, name='likes_state'),
 ]